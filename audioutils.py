@@ -2,70 +2,605 @@
 Routines to read and manipulate audio files.
 """
 
+import os
 import sys
-from byteutils import printInHexAndText, readInt
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from byteutils import readInt
 
 def readWavefileHeader(filename):
     """
     Read a wavefile header.  Return a dictionary with the parameters.
+
+    Only the 8 byte chunk headers are read while walking the RIFF
+    chunks, the bodies of chunks we don't care about (LIST, bext, fact
+    and so on) are skipped with seek.  "dataoffset" and "nbytes" give
+    the position and length of the audio data.
     
     """
 
     waveheader = {}
     with open(filename, 'rb') as file:
 
-        riffhdr  = file.read(4)
-        if (riffhdr != b'RIFF'):
+        riffhdr  = file.read(12)
+        if (riffhdr[0:4] != b'RIFF'):
             print(filename, 'is not a RIFF file', file=sys.stderr)
             raise ValueError
 
-        p,whdrlength = readInt(file.read(4))
-
-        hdrbytes = file.read(whdrlength)
-        
-        wavehdr = hdrbytes[0:4]
-        if (wavehdr == b'WAVE'):
-            hdrbytes = hdrbytes[4:]
-        else:
+        if (riffhdr[8:12] != b'WAVE'):
             print(filename, 'is not a WAVE file', file=sys.stderr)
             raise ValueError
 
-        # The format section begins with the string 'fmt ' and describes the
-        # format of the file.  I am only interested in PCM encoded audio
-        # data so I bail out if it is anything else.
+        fmtbytes   = None
+        dataoffset = None
+        while (fmtbytes is None) or (dataoffset is None):
+            chunkhdr = file.read(8)
+            if (len(chunkhdr) < 8):
+                break
+            chunkid = chunkhdr[0:4]
+            pos,chunklength = readInt(chunkhdr,4)
 
-        fmtstring = hdrbytes[0:4]
-        if (fmtstring!=b'fmt '):
-            print('This is not a PCM file', file=sys.stderr)
-            raise ValueError
-        hdrbytes = hdrbytes[4:]
-    
-        pos,dhdrlength = readInt(hdrbytes)
-        hdrbytes = hdrbytes[pos:]
-    
-        pos,pcm = readInt(hdrbytes,0,2)
-        if (pcm!=1):
-            print('This is not a PCM file', file=sys.stderr)
-            raise ValueError
+            # The format section begins with the string 'fmt ' and
+            # describes the format of the file.
+            if (chunkid == b'fmt '):
+                fmtbytes = file.read(chunklength)
+                if (len(fmtbytes) < 16):
+                    break
+                file.seek(chunklength & 1, 1)
+            elif (chunkid == b'data'):
+                dataoffset = file.tell()
+                nbytes = chunklength
+                file.seek(chunklength + (chunklength & 1), 1)
+            else:
+                # Chunks are padded to an even length.
+                file.seek(chunklength + (chunklength & 1), 1)
 
-        pos,channels = readInt(hdrbytes,pos,2)
-        pos,rate = readInt(hdrbytes,pos,4)
-        pos,byterate = readInt(hdrbytes,pos,4)
-        pos,bytespersample = readInt(hdrbytes,pos,2)
-        pos,bps = readInt(hdrbytes,pos,2)
-        data = hdrbytes[pos:pos+4]
-        pos = pos+4
-        if (data != b'data'):
-            print('There is no data section', file=sys.stderr)
-            raise ValueError
-        pos,nbytes = readInt(hdrbytes,pos,4)
+    # I am only interested in PCM encoded audio data so I bail out if
+    # it is anything else.
+
+    if (fmtbytes is None) or (len(fmtbytes) < 16):
+        print('This is not a PCM file', file=sys.stderr)
+        raise ValueError
 
-        waveheader["channels"] = channels
-        waveheader["rate"] = rate
-        waveheader["byterate"] = byterate
-        waveheader["bytespersample"] = bytespersample
-        waveheader["bitsperchannel"] = bps
-        waveheader["nbytes"] = nbytes
+    pos,pcm = readInt(fmtbytes,0,2)
+    if (pcm!=1):
+        print('This is not a PCM file', file=sys.stderr)
+        raise ValueError
+
+    pos,channels = readInt(fmtbytes,pos,2)
+    pos,rate = readInt(fmtbytes,pos,4)
+    pos,byterate = readInt(fmtbytes,pos,4)
+    pos,bytespersample = readInt(fmtbytes,pos,2)
+    pos,bps = readInt(fmtbytes,pos,2)
+
+    if (dataoffset is None):
+        print('There is no data section', file=sys.stderr)
+        raise ValueError
+
+    waveheader["channels"] = channels
+    waveheader["rate"] = rate
+    waveheader["byterate"] = byterate
+    waveheader["bytespersample"] = bytespersample
+    waveheader["bitsperchannel"] = bps
+    waveheader["nbytes"] = nbytes
+    waveheader["dataoffset"] = dataoffset
 
     return waveheader
 
+def probeWavefileHeaders(filenames, max_workers=8):
+    """
+    Read the headers of a list of wavefiles concurrently using a
+    bounded pool of threads, going through the shared header cache.
+    Opening files on network storage is mostly waiting, so this
+    overlaps the latency.  Returns a list of
+    header dictionaries in the same order as filenames.  Each distinct
+    file is only read once.
+
+    """
+
+    unique = list(dict.fromkeys(filenames))
+    if (max_workers <= 1) or (len(unique) <= 1):
+        headers = [readWavefileHeaderCached(filename) for filename in unique]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(unique))) as pool:
+            headers = list(pool.map(readWavefileHeaderCached, unique))
+    byname = dict(zip(unique, headers))
+    return [byname[filename] for filename in filenames]
+
+# Samples per CD-DA frame at 44.1 kHz, there are 75 frames per second.
+SAMPLES_PER_FRAME = 588
+FRAMES_PER_SECOND = 75
+
+def pcmSamples(filename, wavehdr=None):
+    """
+    Memory map the data chunk of a PCM wavefile as a NumPy array of
+    shape (samples, channels).  8 bit data is unsigned, 16 and 32 bit
+    data is signed.  Nothing is read until the array is used.
+
+    """
+    import numpy as np
+
+    if wavehdr is None:
+        wavehdr = readWavefileHeader(filename)
+    dtypes = {8: np.uint8, 16: np.dtype('<i2'), 32: np.dtype('<i4')}
+    bits = wavehdr["bitsperchannel"]
+    if bits not in dtypes:
+        raise ValueError('%s: %d bit samples are not supported'%(filename, bits))
+    channels = wavehdr["channels"]
+    nsamples = wavehdr["nbytes"]//wavehdr["bytespersample"]
+    if nsamples == 0:
+        return np.zeros((0, channels), dtype=dtypes[bits])
+    return np.memmap(filename, dtype=dtypes[bits], mode='r', offset=wavehdr["dataoffset"],
+                     shape=(nsamples, channels))
+
+def findSilence(filename, threshold=-60.0, wavehdr=None, chunkframes=2048):
+    """
+    Find the silence at the start and end of a wavefile.  A frame
+    (1/75 s, 588 samples at 44.1 kHz) is silent if no sample in it is
+    louder than threshold dB below full scale.  Returns a dictionary
+    with the total number of frames and the number of silent frames
+    at the start ("leading") and the end ("trailing").
+
+    The file is memory mapped and scanned a chunk of frames at a time
+    from each end, stopping at the first sound, so only the silent
+    parts are actually read.
+
+    """
+    import numpy as np
+
+    if wavehdr is None:
+        wavehdr = readWavefileHeader(filename)
+    samples = pcmSamples(filename, wavehdr)
+    bits = wavehdr["bitsperchannel"]
+    limit = (2**(bits-1))*10**(threshold/20.0)
+    center = 128 if bits == 8 else 0
+
+    framesize = max(1, int(round(wavehdr["rate"]/FRAMES_PER_SECOND)))
+    nframes = -(-len(samples)//framesize)
+
+    def loudFrames(first, last):
+        # True for each frame in [first, last) with a sample over the limit.
+        block = samples[first*framesize:last*framesize]
+        peaks = np.zeros(last-first)
+        if len(block) > 0:
+            block = np.abs(block.astype(np.int64) - center).max(axis=1)
+            full = len(block)//framesize
+            if full > 0:
+                peaks[:full] = block[:full*framesize].reshape(full, framesize).max(axis=1)
+            if full < last-first:
+                peaks[full] = block[full*framesize:].max()
+        return peaks > limit
+
+    leading = nframes
+    for first in range(0, nframes, chunkframes):
+        loud = loudFrames(first, min(first+chunkframes, nframes))
+        if loud.any():
+            leading = first + int(loud.argmax())
+            break
+
+    trailing = 0
+    if leading < nframes:
+        for last in range(nframes, 0, -chunkframes):
+            first = max(0, last-chunkframes)
+            loud = loudFrames(first, last)
+            if loud.any():
+                trailing = nframes - (first + len(loud) - int(loud[::-1].argmax()))
+                break
+    else:
+        trailing = nframes
+
+    return {"frames": nframes, "leading": leading, "trailing": trailing}
+
+def findSilences(filenames, threshold=-60.0, max_workers=8):
+    """
+    findSilence for a list of files, using a pool of threads.  NumPy
+    lets go of the interpreter while it works so the files overlap.
+
+    """
+    unique = list(dict.fromkeys(filenames))
+    def analyze(filename):
+        return findSilence(filename, threshold, readWavefileHeaderCached(filename))
+    if (max_workers <= 1) or (len(unique) <= 1):
+        results = [analyze(filename) for filename in unique]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(unique))) as pool:
+            results = list(pool.map(analyze, unique))
+    byname = dict(zip(unique, results))
+    return [byname[filename] for filename in filenames]
+
+# K-weighting of ITU-R BS.1770 as the two biquads given for 48 kHz: a
+# high shelf for the head and a high pass (RLB).
+K_WEIGHTING = (((1.53512485958697, -2.69169618940638, 1.19839281085285),
+                (1.0, -1.69065929318241, 0.73248077421585)),
+               ((1.0, -2.0, 1.0),
+                (1.0, -1.99004745483398, 0.99007225036621)))
+
+def _kWeights(nsamples, rate):
+    """The power response of the K-weighting at the rfft bins of
+    nsamples samples taken at rate.
+
+    """
+    import numpy as np
+
+    omega = 2*np.pi*np.fft.rfftfreq(nsamples, 1.0/rate)/48000
+    z = np.exp(-1j*omega)
+    weights = np.ones(len(omega))
+    for b, a in K_WEIGHTING:
+        h = (b[0] + b[1]*z + b[2]*z*z)/(a[0] + a[1]*z + a[2]*z*z)
+        weights *= np.abs(h)**2
+    return weights
+
+def analyzeLoudness(filename, wavehdr=None, chunkseconds=10):
+    """
+    Measure a wavefile.  Returns a dictionary with the sample peak and
+    the RMS level in dB relative to full scale ("peak", "rms") and the
+    integrated loudness in LUFS ("loudness").  Each is None if the file
+    is digital silence.
+
+    The loudness follows EBU R128: 400 ms blocks overlapping by 75%,
+    an absolute gate at -70 LUFS and a relative gate 10 LU below the
+    loudness of the blocks that pass it.  The K-weighting is applied to
+    the spectrum of each 100 ms piece rather than by running the
+    filters over the whole file, which is close enough to decide on
+    gain.
+
+    The file is memory mapped and read chunkseconds at a time so memory
+    use does not depend on the length of the track.
+
+    """
+    import numpy as np
+
+    if wavehdr is None:
+        wavehdr = readWavefileHeader(filename)
+    samples = pcmSamples(filename, wavehdr)
+    bits = wavehdr["bitsperchannel"]
+    full = float(2**(bits-1))
+    center = 128 if bits == 8 else 0
+
+    blocksize = max(1, wavehdr["rate"]//10)
+    chunksize = blocksize*max(1, int(chunkseconds*10))
+    weights = _kWeights(blocksize, wavehdr["rate"])
+    # Parseval for a real FFT: the bins other than DC and Nyquist stand
+    # for two.
+    weights[1:(blocksize+1)//2] *= 2
+    weights /= blocksize*blocksize
+
+    peak = 0.0
+    sumsquares = 0.0
+    powers = []
+    for first in range(0, len(samples), chunksize):
+        chunk = (np.asarray(samples[first:first+chunksize], dtype=np.float64) - center)/full
+        peak = max(peak, float(np.abs(chunk).max()))
+        sumsquares += float(np.einsum('ij,ij->', chunk, chunk))
+        nblocks = len(chunk)//blocksize
+        if nblocks > 0:
+            blocks = chunk[:nblocks*blocksize].reshape(nblocks, blocksize, chunk.shape[1])
+            spectra = np.fft.rfft(blocks, axis=1)
+            power = (spectra.real**2 + spectra.imag**2)*weights[:, np.newaxis]
+            powers.append(power.sum(axis=(1, 2)))
+
+    def decibels(value):
+        return None if value <= 0 else 10*np.log10(value)
+
+    nvalues = samples.shape[0]*samples.shape[1]
+    result = {"peak": decibels(peak*peak),
+              "rms": decibels(sumsquares/nvalues) if nvalues else None,
+              "loudness": None}
+
+    if powers:
+        powers = np.concatenate(powers)
+        if len(powers) >= 4:
+            gated = np.convolve(powers, np.ones(4)/4, mode='valid')
+        else:
+            gated = powers
+        gated = gated[gated > 10**((-70.0+0.691)/10)]
+        if len(gated) > 0:
+            relative = gated.mean()*10**(-10.0/10)
+            gated = gated[gated > relative]
+            result["loudness"] = -0.691 + decibels(gated.mean())
+
+    for name, value in result.items():
+        if value is not None:
+            result[name] = round(float(value), 2)
+    return result
+
+# Bump this when the contents of a header dictionary change so that
+# entries written by an older version are not used.
+WAVE_HEADER_VERSION = 2
+
+class FileInfoCache:
+    """
+    Cache of information about files, keyed by file name.  reader is
+    called with a file name to get the information, a dictionary that
+    can be stored as JSON.  An entry is only used while the file's size
+    and modification time are unchanged.  The most recently used
+    entries are kept in memory and, if a path is given, all of them are
+    kept in a table of a small SQLite database so they survive from
+    one run to the next.  If the database can't be created or used the
+    cache carries on in memory only.  Safe to share between threads.
+
+    """
+
+    def __init__(self, reader, table, path=None, maxsize=4096):
+        self.reader  = reader
+        self.path    = path
+        self.maxsize = maxsize
+        self.hits    = 0
+        self.misses  = 0
+        self._memory = OrderedDict()
+        self._lock   = threading.Lock()
+        self._db     = None
+        self._table  = table
+        if path is not None:
+            try:
+                dirname = os.path.dirname(path)
+                if dirname:
+                    os.makedirs(dirname, exist_ok=True)
+                self._db = sqlite3.connect(path, timeout=30, isolation_level=None,
+                                           check_same_thread=False)
+                self._db.execute('CREATE TABLE IF NOT EXISTS %s '
+                                 '(path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, info TEXT)'
+                                 %self._table)
+            except (OSError, sqlite3.Error):
+                self._dropDatabase()
+
+    def get(self, filename):
+        """Return the information for filename, reading the file only if
+        there is no valid cached entry.
+
+        """
+        info = self.lookup(filename)
+        if info is None:
+            stat = os.stat(filename)
+            info = self.reader(filename)
+            self.put(filename, info, stat)
+        return dict(info)
+
+    def lookup(self, filename):
+        """Return the cached information for filename, or None if there
+        is no valid entry.
+
+        """
+        key  = os.path.abspath(filename)
+        stat = os.stat(key)
+        with self._lock:
+            entry = self._lookup(key)
+            if (entry is not None) and (entry[0] == stat.st_size) and (entry[1] == stat.st_mtime_ns):
+                self.hits += 1
+                return dict(entry[2])
+            self.misses += 1
+        return None
+
+    def put(self, filename, info, stat=None):
+        """Store information about filename that was worked out elsewhere.
+        stat should be taken before the file was read.
+
+        """
+        key = os.path.abspath(filename)
+        if stat is None:
+            stat = os.stat(key)
+        with self._lock:
+            self._store(key, (stat.st_size, stat.st_mtime_ns, info))
+
+    def invalidate(self, filename=None):
+        """Forget the entry for filename, or every entry if no file name
+        is given.
+
+        """
+        with self._lock:
+            if filename is None:
+                self._memory.clear()
+                self._execute('DELETE FROM %s'%self._table)
+            else:
+                key = os.path.abspath(filename)
+                self._memory.pop(key, None)
+                self._execute('DELETE FROM %s WHERE path = ?'%self._table, (key,))
+
+    def close(self):
+        """Close the database.  The memory part of the cache still works.
+
+        """
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _lookup(self, key):
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            return entry
+        row = self._execute('SELECT * FROM %s WHERE path = ?'%self._table, (key,))
+        if row is None:
+            return None
+        entry = (row[1], row[2], json.loads(row[3]))
+        self._remember(key, entry)
+        return entry
+
+    def _store(self, key, entry):
+        self._remember(key, entry)
+        self._execute('INSERT OR REPLACE INTO %s VALUES (?, ?, ?, ?)'%self._table,
+                      (key, entry[0], entry[1], json.dumps(entry[2])))
+
+    def _execute(self, sql, params=()):
+        """Run sql on the database and return the first row.  Returns
+        None if there is no database or it fails, in which case it is
+        dropped and the cache works from memory from then on.
+
+        """
+        if self._db is None:
+            return None
+        try:
+            return self._db.execute(sql, params).fetchone()
+        except sqlite3.Error:
+            self._dropDatabase()
+            return None
+
+    def _dropDatabase(self):
+        # The database is only there to save work, so losing it is not
+        # an error.
+        if self._db is not None:
+            try:
+                self._db.close()
+            except sqlite3.Error:
+                pass
+        self._db = None
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+class WaveHeaderCache(FileInfoCache):
+    """
+    Cache of wavefile headers, see FileInfoCache.
+
+    """
+
+    def __init__(self, path=None, maxsize=4096):
+        FileInfoCache.__init__(self, readWavefileHeader,
+                               'wave_headers_v%d'%WAVE_HEADER_VERSION, path, maxsize)
+
+_wave_header_cache = None
+_wave_header_cache_lock = threading.Lock()
+
+def defaultCachePath(name):
+    """
+    Where the on-disk caches live.  $NEROTOOLS_CACHE_DIR if it is set,
+    otherwise nerotools under $XDG_CACHE_HOME or ~/.cache.
+
+    """
+    cachedir = os.environ.get('NEROTOOLS_CACHE_DIR')
+    if not cachedir:
+        cachedir = os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                                os.path.join(os.path.expanduser('~'), '.cache'), 'nerotools')
+    return os.path.join(cachedir, name)
+
+def waveHeaderCache():
+    """
+    Return the shared wavefile header cache, creating it on first use.
+
+    """
+    global _wave_header_cache
+    with _wave_header_cache_lock:
+        if _wave_header_cache is None:
+            _wave_header_cache = WaveHeaderCache(defaultCachePath('waveheaders.sqlite'))
+        return _wave_header_cache
+
+def setWaveHeaderCache(cache):
+    """
+    Replace the shared wavefile header cache, for example with
+    WaveHeaderCache() to keep it in memory only.
+
+    """
+    global _wave_header_cache
+    with _wave_header_cache_lock:
+        _wave_header_cache = cache
+
+def readWavefileHeaderCached(filename):
+    """
+    Same as readWavefileHeader but goes through the shared cache.
+
+    """
+    return waveHeaderCache().get(filename)
+
+def invalidateWavefileHeader(filename=None):
+    """
+    Drop filename (or everything) from the shared cache.
+
+    """
+    waveHeaderCache().invalidate(filename)
+
+# Bump this when analyzeLoudness changes.
+LOUDNESS_VERSION = 1
+
+class LoudnessCache(FileInfoCache):
+    """
+    Cache of analyzeLoudness results, see FileInfoCache.
+
+    """
+
+    def __init__(self, path=None, maxsize=4096):
+        FileInfoCache.__init__(self, _analyzeLoudness,
+                               'loudness_v%d'%LOUDNESS_VERSION, path, maxsize)
+
+_loudness_cache = None
+_loudness_cache_lock = threading.Lock()
+
+def loudnessCache():
+    """
+    Return the shared loudness cache, creating it on first use.
+
+    """
+    global _loudness_cache
+    with _loudness_cache_lock:
+        if _loudness_cache is None:
+            _loudness_cache = LoudnessCache(defaultCachePath('loudness.sqlite'))
+        return _loudness_cache
+
+def setLoudnessCache(cache):
+    """
+    Replace the shared loudness cache.
+
+    """
+    global _loudness_cache
+    with _loudness_cache_lock:
+        _loudness_cache = cache
+
+def _analyzeLoudness(filename):
+    return analyzeLoudness(filename)
+
+def analyzeLoudnessAll(filenames, max_workers=None):
+    """
+    analyzeLoudness for a list of files.  Files already in the shared
+    cache are not opened, the rest are spread over a pool of
+    max_workers processes (one per CPU by default, none if it is 1 or
+    less) and the results stored in the cache.
+
+    """
+    cache = loudnessCache()
+    unique = list(dict.fromkeys(filenames))
+    byname = {}
+    missing = []
+    for filename in unique:
+        result = cache.lookup(filename)
+        if result is None:
+            missing.append((filename, os.stat(filename)))
+        else:
+            byname[filename] = result
+
+    if ((max_workers is not None) and (max_workers <= 1)) or (len(missing) <= 1):
+        results = [_analyzeLoudness(filename) for filename, stat in missing]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(_analyzeLoudness, [filename for filename, stat in missing]))
+    for (filename, stat), result in zip(missing, results):
+        cache.put(filename, result, stat)
+        byname[filename] = result
+
+    return [dict(byname[filename]) for filename in filenames]
+
+def measureTrackLoudness(tracks, max_workers=None):
+    """
+    Set the loudness attribute of each track to the analyzeLoudness
+    result for its linux_file_name.
+
+    """
+    results = analyzeLoudnessAll([track.linux_file_name for track in tracks], max_workers)
+    for track, result in zip(tracks, results):
+        track.loudness = result
+
+def normalizeWanted(tracks, spread=3.0):
+    """
+    True if the integrated loudness of the measured tracks differs by
+    more than spread LU, so the "normalize all tracks" option is worth
+    setting.  Tracks that are not measured or are silent are left out.
+
+    """
+    levels = [track.loudness["loudness"] for track in tracks
+              if track.loudness and (track.loudness["loudness"] is not None)]
+    return bool(levels) and (max(levels) - min(levels) > spread)
@@ -0,0 +1,273 @@
+#!/usr/bin/python3
+
+"""
+Benchmarks for reading and writing Nero project (.nra) files.
+
+Synthetic projects and matching wavefiles are generated in a scratch
+directory.  The wavefiles are sparse so even long tracks cost almost
+no disk.  Each benchmark reports the best wall time over a number of
+repeats and the peak memory allocated by Python (tracemalloc) during
+one run.  Results are written as JSON so two runs can be compared
+with --compare, which exits with status 1 if anything got slower.
+
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+
+from cdutils import Album, Disc, Track
+from byteutils import readInt, readInts, writeInt, writeInts
+from byteutils import writeShortString, writeLongString
+from audioutils import readWavefileHeader, WaveHeaderCache, setWaveHeaderCache
+from readnerofile import readNeroFile, openNeroFile
+from writenerofile import writeNeroFile
+
+#------------------------------------------------------------
+# Generators.
+
+def makeWavefile(filename, seconds, rate=44100, channels=2, bits=16, extra_chunks=b''):
+    """Write a PCM wavefile of the given length.  The audio is left as
+    a hole in the file so it reads back as silence.  extra_chunks is
+    inserted between the fmt and data chunks.
+
+    """
+    bytespersample = channels*bits//8
+    nbytes = int(seconds*rate)*bytespersample
+    fmtbytes = (writeInt(1,2) + writeInt(channels,2) + writeInt(rate) +
+                writeInt(rate*bytespersample) + writeInt(bytespersample,2) + writeInt(bits,2))
+    header = (b'WAVE' + b'fmt ' + writeInt(len(fmtbytes)) + fmtbytes + extra_chunks +
+              b'data' + writeInt(nbytes))
+    with open(filename, 'wb') as file:
+        file.write(b'RIFF' + writeInt(len(header) + nbytes) + header)
+        file.truncate(8 + len(header) + nbytes)
+    return filename
+
+def makeText(length, seed):
+    """A repeatable string of the given length."""
+    text = '%d-abcdefghijklmnopqrstuvwxyz0123456789'%seed
+    return (text*(length//len(text)+1))[:length]
+
+def makeAlbum(num_tracks, wavdir, string_length=20, num_discs=1, seconds=180, seed=0):
+    """Build an Album with num_discs discs of num_tracks tracks each.
+    Every track gets its own wavefile in wavdir.  CD text strings are
+    at most 255 characters, the limit of a short string.
+
+    """
+    short_length = min(string_length, 255)
+    album = Album(makeText(short_length, seed))
+    album.artist    = makeText(short_length, seed+1)
+    album.copyright = makeText(short_length, seed+2)
+    album.author    = makeText(short_length, seed+3)
+    album.mcn       = '1234567890123'
+    album.rdate     = '01/16/2020'
+    album.comment   = makeText(short_length, seed+4)
+    album.disc_count = num_discs
+    for discno in range(1, num_discs+1):
+        disc = Disc('disc %d'%discno)
+        disc.discno = discno
+        album.discs.append(disc)
+        for trackno in range(1, num_tracks+1):
+            wavname = os.path.join(wavdir, 'd%02dt%02d.wav'%(discno, trackno))
+            if not os.path.exists(wavname):
+                makeWavefile(wavname, seconds + trackno)
+            track = Track()
+            track.fileName('C:\\Music\\' + makeText(string_length, trackno) + '.wav')
+            track.linuxFileName(wavname)
+            track.artistName(makeText(string_length, seed+trackno))
+            track.trackName(makeText(string_length, seed+2*trackno))
+            track.ISRC('USK40140%04d'%trackno)
+            track.trackNumber(trackno)
+            track.trackCount(num_tracks)
+            track.discNumber(discno)
+            track.discCount(num_discs)
+            disc.tracks.append(track)
+            album.tracks.append(track)
+    return album
+
+def makeProjects(directory, num_projects, num_tracks, string_length=20):
+    """Write num_projects single disc projects into directory.  The
+    projects share one set of wavefiles.  Returns the file names.
+
+    """
+    wavdir = os.path.join(directory, 'wav')
+    os.makedirs(wavdir, exist_ok=True)
+    filenames = []
+    for project in range(num_projects):
+        album = makeAlbum(num_tracks, wavdir, string_length, seed=project)
+        filename = os.path.join(directory, 'project%05d.nra'%project)
+        with open(filename, 'wb') as file:
+            writeNeroFile(album, outfile=file)
+        filenames.append(filename)
+    return filenames
+
+#------------------------------------------------------------
+# Measurement.
+
+def measure(name, func, repeat=5, **params):
+    """Time func (best of repeat runs) and measure its peak Python
+    memory use.  Returns a result dictionary.
+
+    """
+    times = []
+    for cnt in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'name': name, 'params': params, 'seconds': min(times),
+            'mean_seconds': sum(times)/len(times), 'peak_bytes': peak}
+
+def runBenchmarks(workdir, track_counts=(1, 10, 99), string_lengths=(20, 200),
+                  num_projects=1000, repeat=5, progress=None):
+    """Run every benchmark and return a list of result dictionaries.
+
+    """
+    results = []
+    def record(result):
+        results.append(result)
+        if progress:
+            progress(result)
+
+    wavdir = os.path.join(workdir, 'wav')
+    os.makedirs(wavdir, exist_ok=True)
+
+    # Keep header caching in memory so runs don't touch the user's cache.
+    cache = WaveHeaderCache()
+    setWaveHeaderCache(cache)
+
+    # byteutils codecs.
+    ints = list(range(26))
+    intbytes = writeInts(ints)
+    def readOneAtATime():
+        position = 0
+        for cnt in range(26):
+            position, value = readInt(intbytes, position)
+    record(measure('readInt x26', readOneAtATime, repeat))
+    record(measure('readInts 26', lambda: readInts(intbytes, 0, 26), repeat))
+    record(measure('writeInt x26', lambda: [writeInt(value) for value in ints], repeat))
+    record(measure('writeInts 26', lambda: writeInts(ints), repeat))
+    for string_length in string_lengths:
+        text = makeText(min(string_length, 255), 0)
+        record(measure('writeShortString', lambda: writeShortString(text), repeat,
+                       string_length=len(text)))
+        record(measure('writeLongString', lambda: writeLongString(text), repeat,
+                       string_length=len(text)))
+
+    # Wavefile headers.
+    plain = makeWavefile(os.path.join(wavdir, 'plain.wav'), 3600)
+    chunky = makeWavefile(os.path.join(wavdir, 'chunky.wav'), 3600,
+                          extra_chunks=b'LIST' + writeInt(4096) + b'\x00'*4096)
+    record(measure('readWavefileHeader', lambda: readWavefileHeader(plain), repeat,
+                   seconds=3600))
+    record(measure('readWavefileHeader', lambda: readWavefileHeader(chunky), repeat,
+                   seconds=3600, list_chunk=4096))
+
+    # Reading and writing single projects.
+    for num_tracks in track_counts:
+        for string_length in string_lengths:
+            params = {'tracks': num_tracks, 'string_length': string_length}
+            album = makeAlbum(num_tracks, wavdir, string_length)
+            filename = os.path.join(workdir, 'bench%d_%d.nra'%(num_tracks, string_length))
+            with open(filename, 'wb') as file:
+                writeNeroFile(album, outfile=file)
+            def coldWrite():
+                cache.invalidate()
+                writeNeroFile(album)
+            record(measure('writeNeroFile cold', coldWrite, repeat, **params))
+            record(measure('writeNeroFile warm', lambda: writeNeroFile(album), repeat, **params))
+            record(measure('readNeroFile', lambda: readNeroFile(filename, trace=None),
+                           repeat, **params))
+            record(measure('readNeroFile mapped',
+                           lambda: readNeroFile(filename, trace=None, mapped=True),
+                           repeat, **params))
+            def lastTitle():
+                with openNeroFile(filename, mapped=True) as lazy:
+                    lazy.tracks[-1].track_name
+            record(measure('openNeroFile last title', lastTitle, repeat, **params))
+
+    # Lots of projects.
+    if num_projects > 0:
+        projdir = os.path.join(workdir, 'projects')
+        os.makedirs(projdir, exist_ok=True)
+        filenames = makeProjects(projdir, num_projects, 12)
+        def readAll():
+            for filename in filenames:
+                readNeroFile(filename, trace=None)
+        record(measure('readNeroFile projects', readAll, max(1, repeat//2),
+                       projects=num_projects, tracks=12))
+
+    return results
+
+def compareResults(old, new, threshold=1.1):
+    """Compare two lists of results.  Returns (name, params, ratio) for
+    every benchmark that got slower by more than threshold.
+
+    """
+    def key(result):
+        return (result['name'], json.dumps(result['params'], sort_keys=True))
+    before = dict([(key(result), result) for result in old])
+    slower = []
+    for result in new:
+        previous = before.get(key(result))
+        if previous and previous['seconds'] > 0:
+            ratio = result['seconds']/previous['seconds']
+            if ratio > threshold:
+                slower.append((result['name'], result['params'], ratio))
+    return slower
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tracks", help="track counts to try", type=int, nargs='+',
+                        default=[1, 10, 99])
+    parser.add_argument("--string-lengths", help="string lengths to try", type=int,
+                        nargs='+', default=[20, 200])
+    parser.add_argument("--projects", help="number of projects for the bulk read",
+                        type=int, default=1000)
+    parser.add_argument("--repeat", help="runs per benchmark", type=int, default=5)
+    parser.add_argument("--output", help="write JSON results here")
+    parser.add_argument("--compare", help="JSON results from an earlier run")
+    parser.add_argument("--workdir", help="scratch directory, a temporary one by default")
+    args = parser.parse_args()
+
+    def progress(result):
+        print('%-28s %-40s %12.6f s %12d bytes'%(result['name'],
+              json.dumps(result['params']), result['seconds'], result['peak_bytes']),
+              file=sys.stderr)
+
+    if args.workdir:
+        results = runBenchmarks(args.workdir, args.tracks, args.string_lengths,
+                                args.projects, args.repeat, progress)
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            results = runBenchmarks(workdir, args.tracks, args.string_lengths,
+                                    args.projects, args.repeat, progress)
+
+    report = {'python': platform.python_version(), 'platform': platform.platform(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+
+    if args.compare:
+        with open(args.compare) as file:
+            old = json.load(file)['results']
+        slower = compareResults(old, results)
+        for name, params, ratio in slower:
+            print('slower: %s %s %.2fx'%(name, json.dumps(params), ratio), file=sys.stderr)
+        if slower:
+            sys.exit(1)
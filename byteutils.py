@@ -4,14 +4,117 @@ reflect this, but this might be more generally useful.
 
 """
 
-from math import ceil
+import sys
+import struct
+
+# Precompiled little endian struct formats keyed by (count, nbytes).
+_int_codes = {1:'B', 2:'H', 4:'I', 8:'Q'}
+_int_structs = {}
+
+# Translation table for the text column of a dump.
+_printable = bytes([b if ( (b>=32)&(b<127) ) else ord('.') for b in range(256)])
+
+def intStruct(count, nbytes=4):
+    """Return a struct.Struct that packs count unsigned little endian
+    ints of nbytes each.  The formats are compiled once and reused.
+
+    """
+    key = (count, nbytes)
+    fmt = _int_structs.get(key)
+    if fmt is None:
+        fmt = struct.Struct('<%d%s'%(count, _int_codes[nbytes]))
+        _int_structs[key] = fmt
+    return fmt
+
+def formatInHex(nradata):
+    """Return the argument as a string of hex digits.
+
+    """
+    return nradata.hex()
+
+def formatInText(nradata):
+    """Return the argument as text with non-printable characters
+    replaced by a period.
+
+    """
+    return bytes(nradata).translate(_printable).decode('ascii')
+
+def formatInHexAndText(nradata):
+    """Return the argument in hex followed by the same stuff in text.
+
+    """
+    return formatInHex(nradata) + ' | ' + formatInText(nradata)
+
+def formatInChunks(nradata, chunksize=8):
+    """Return the data in hex and text with chunksize bytes per line.
+
+    """
+    return formatHexDump(nradata, chunksize)
+
+def formatHexDump(nradata, chunksize=16, offset=None):
+    """Format a whole block of data in hex and text, chunksize bytes per
+    line.  The hex and the text for the block are each converted in one
+    go and then cut into lines.  If offset is given each line starts
+    with its offset, counting from offset, and the hex column is padded
+    so the text lines up.
+
+    """
+    nbytes = len(nradata)
+    if nbytes == 0:
+        return ''
+    hexstr = bytes(nradata).hex()
+    text = bytes(nradata).translate(_printable).decode('ascii')
+    width = 2*chunksize
+    if offset is None:
+        return '\n'.join([hexstr[2*pos:2*pos+width] + ' | ' + text[pos:pos+chunksize]
+                          for pos in range(0, nbytes, chunksize)])
+    return '\n'.join(['%08x  %s | %s'%(offset+pos, hexstr[2*pos:2*pos+width].ljust(width),
+                                       text[pos:pos+chunksize])
+                      for pos in range(0, nbytes, chunksize)])
+
+def hexDump(nradata, chunksize=16, regions=None, file=None, blocksize=65536):
+    """Write a hex dump of the data to file (standard out by default),
+    with offsets.  The data is formatted a block at a time and each
+    block is written with a single call.
+
+    regions is an optional list of (start, end, label) giving sections
+    of the data to annotate, such as the list made by neroRegions in
+    readnerofile.  Each region starts on a new line under its label.
+
+    """
+    if file is None:
+        file = sys.stdout
+    nbytes = len(nradata)
+    if regions is None:
+        regions = [(0, nbytes, None)]
+    else:
+        # Fill in any gaps so every byte gets dumped.
+        filled = []
+        position = 0
+        for start, end, label in sorted(regions):
+            if start > position:
+                filled.append((position, start, None))
+            filled.append((max(start, position), end, label))
+            position = max(position, end)
+        if position < nbytes:
+            filled.append((position, nbytes, None))
+        regions = filled
+
+    # Keep blocks a whole number of lines.
+    blocksize = max(chunksize, blocksize - blocksize%chunksize)
+    for start, end, label in regions:
+        if label is not None:
+            file.write('-- %s: %d bytes at 0x%x\n'%(label, end-start, start))
+        for position in range(start, end, blocksize):
+            blockend = min(position+blocksize, end)
+            file.write(formatHexDump(nradata[position:blockend], chunksize, position) + '\n')
 
 def printInHex(nradata, end=''):
     """Print the argument to to standard out in hex.  The value of 'end'
     will be appended to the line.
 
     """
-    print( nradata.hex(), end=end )
+    print( formatInHex(nradata), end=end )
     
 def printInText(nradata, end='\n'):
     """Print the argument to to standard out in text with non-printable
@@ -19,25 +122,21 @@ def printInText(nradata, end='\n'):
     appended to the line.
 
     """
-    print( ''.join([chr(b) if ( (b>=32)&(b<127) ) else '.' for b in nradata]), end=end )
+    print( formatInText(nradata), end=end )
     
 def printInHexAndText(nradata, end='\n'):
     """Print the argument to to standard out in hex followed by the same
     stuff in text.  The value of 'end' will be appended to the line.
 
     """
-    printInHex(nradata, end=' | ')
-    printInText(nradata, end=end)
+    print( formatInHexAndText(nradata), end=end )
 
 def printInChunks(nradata, chunksize=8):
     """Print the data in hex and text with chunksize bytes per line.
 
     """
-    nbytes = len(nradata)
-    chunksize = 8
-    nchunks = ceil(nbytes/chunksize)
-    for chunk in range(nchunks):
-        printInHexAndText(nradata[chunk*chunksize:(chunk+1)*chunksize])
+    if len(nradata) > 0:
+        print( formatInChunks(nradata, chunksize) )
 
 def printNextBytes(nradata, position, nbytes=10):
     """Print bytes in hex with some text.
@@ -46,28 +145,46 @@ def printNextBytes(nradata, position, nbytes=10):
     print('Next bytes at position',position, '%x'%position)
     printInHexAndText(nradata[position:position+nbytes])
 
+def readInts(nradata, position=0, count=1, nbytes=4):
+    """Read count nbyte ints encoded little endian in one go.  Returns
+    the new position and a list of the values.
+
+    """
+    if nbytes in _int_codes:
+        values = list(intStruct(count, nbytes).unpack_from(nradata, position))
+    else:
+        if position+count*nbytes > len(nradata):
+            raise IndexError('not enough data for %d %d byte ints'%(count, nbytes))
+        values = [int.from_bytes(nradata[pos:pos+nbytes], 'little')
+                  for pos in range(position, position+count*nbytes, nbytes)]
+    return position + count*nbytes, values
+
 def readInt(nradata, position=0, nbytes=4):
     """Read nbyte byte ints encoded little endian.
 
     """
-    myint = 0
-    for pos in range(position+nbytes-1,position-1,-1):
-        myint = 256*myint+nradata[pos]
-    position = position + nbytes
-    return position, myint
+    position, values = readInts(nradata, position, 1, nbytes)
+    return position, values[0]
 
 def readShortString(nradata, position):
     """Each "short text" string begins with a preamble 0xfffeff.
     I think the 0xfffe is a unicode byte order marker.  I
     don't think the 0xff is part of the unicode structure.
     Following the preamble is a 1 byte length.
+
+    nradata may be a memoryview, the only copy made is the decoded
+    string.
     """
-    bom = nradata[0:2]
+    if nradata[0:2] == b'\xfe\xff':
+        encoding = 'utf-16-be'
+    else:
+        encoding = 'utf-16-le'
     position = position + 3
     cnt = nradata[position]
     position = position + 1
-    bts = bom + nradata[position:position+2*cnt]
-    text = bts.decode('utf-16')
+    if position+2*cnt > len(nradata):
+        raise IndexError('short string runs past the end of the data')
+    text = str(nradata[position:position+2*cnt], encoding)
     position += 2*cnt
     return position, text
 
@@ -77,20 +194,28 @@ def readLongString(nradata, position):
 
     """
     position,cnt = readInt(nradata,position)
-    bts = bytearray(nradata[position:position+2*cnt])
-    text = bts.decode('utf-16')
+    if position+2*cnt > len(nradata):
+        raise IndexError('long string runs past the end of the data')
+    text = str(nradata[position:position+2*cnt], 'utf-16-le')
     position += 2*(cnt+1) # Eat the trailing c-style zero bytes.
     return position, text
 
+def writeInts(values, nbytes=4):
+    """Write a sequence of nbytes length integers encoded little endian.
+    Values are masked to nbytes, so -1 is written as all ones.
+
+    """
+    mask = (1 << 8*nbytes)-1
+    values = [value & mask for value in values]
+    if nbytes in _int_codes:
+        return intStruct(len(values), nbytes).pack(*values)
+    return b''.join([value.to_bytes(nbytes, 'little') for value in values])
+
 def writeInt(value, nbytes=4):
     """Write nbytes length integer encoded little endian.
 
     """
-    outbytes = bytearray(nbytes)
-    for idx in range(nbytes):
-        outbytes[idx] = value & 0xff
-        value = value >> 8
-    return bytes(outbytes)
+    return writeInts([value], nbytes)
 
 def writeShortString(strng):
     """Write a short string - see readShortString for the format.
@@ -0,0 +1,245 @@
+#!/usr/bin/python3
+
+"""
+Cache parsed Nero project (.nra) files so they can be opened again
+without parsing them.
+
+An Album read by readNeroFile is saved in a small binary file of its
+own: a header naming the source file with its size and modification
+time, then the album, disc and track fields.  Every string, byte
+field and list of ints is preceded by its length and strings are
+UTF-8, so loading is a run of slices with no UTF-16 decoding and no
+walking of the .nra layout.  Nothing in the file is ever executed.
+A cached album is only used while the source file has the same size
+and modification time.
+
+File layout, all ints little endian:
+
+  'NRAC', format version (4 bytes), payload length (4 bytes)
+  source size (8 bytes), source mtime in ns (8 bytes), source path
+  album strings: title, artist, copyright, author, mcn, rdate, comment
+  disc_count, cd_options, track_flags, hex_value,
+  global_track_options, burn_options
+  number of tracks in Album.tracks, number of tracks on the album
+  and all discs, then for each track its strings, numbers, frames,
+  protection, filter_tag and filter_data
+  number of discs, then for each disc its title, discno and the
+  indexes of its tracks (0xffffffff for a disc holding all of them)
+
+"""
+
+import os
+import sys
+import struct
+import hashlib
+import argparse
+
+from byteutils import intStruct
+from cdutils import Album, Disc, Track
+from readnerofile import readNeroFile, NeroFileError
+from audioutils import defaultCachePath
+from scannerofiles import findNeroFiles
+
+ALBUM_CACHE_MAGIC = b'NRAC'
+
+# Bump this when the layout changes, older files are then ignored.
+ALBUM_CACHE_VERSION = 1
+
+ALBUM_STRINGS = ('title', 'artist', 'copyright', 'author', 'mcn', 'rdate', 'comment')
+ALBUM_LISTS   = ('cd_options', 'track_flags', 'global_track_options', 'burn_options')
+TRACK_STRINGS = ('artist_name', 'track_name', 'album_name', 'performer', 'isrc',
+                 'file_name', 'linux_file_name', 'track_year')
+TRACK_NUMBERS = ('track_count', 'track_number', 'disc_count', 'disc_number', 'protection')
+
+ALL_TRACKS = 0xffffffff
+
+_int  = intStruct(1)
+_long = intStruct(1, 8)
+
+class AlbumCacheError(ValueError):
+    """A cache file is not in the expected format."""
+
+def _blob(parts, data):
+    parts.append(_int.pack(len(data)))
+    parts.append(data)
+
+def _ints(parts, values):
+    parts.append(_int.pack(len(values)))
+    parts.append(intStruct(len(values)).pack(*values))
+
+def encodeAlbum(album, path='', size=0, mtime_ns=0):
+    """Encode an Album in the cache format."""
+    parts = [_long.pack(size), _long.pack(mtime_ns)]
+    _blob(parts, path.encode('utf-8'))
+    for name in ALBUM_STRINGS:
+        _blob(parts, getattr(album, name).encode('utf-8'))
+    parts.append(_int.pack(album.disc_count))
+    for name in ALBUM_LISTS:
+        _ints(parts, getattr(album, name))
+    _blob(parts, bytes(album.hex_value))
+
+    tracks = list(album.tracks)
+    index = dict((id(track), number) for number, track in enumerate(tracks))
+    for disc in album.discs:
+        for track in disc.tracks:
+            if id(track) not in index:
+                index[id(track)] = len(tracks)
+                tracks.append(track)
+
+    parts.append(_int.pack(len(album.tracks)))
+    parts.append(_int.pack(len(tracks)))
+    numbers = intStruct(len(TRACK_NUMBERS) + 7)
+    for track in tracks:
+        for name in TRACK_STRINGS:
+            _blob(parts, getattr(track, name).encode('utf-8'))
+        parts.append(numbers.pack(*([getattr(track, name) for name in TRACK_NUMBERS] +
+                                    list(track.frames))))
+        _blob(parts, bytes(track.filter_tag))
+        _blob(parts, bytes(track.filter_data))
+
+    parts.append(_int.pack(len(album.discs)))
+    for disc in album.discs:
+        _blob(parts, disc.title.encode('utf-8'))
+        parts.append(_int.pack(disc.discno))
+        if disc.tracks is album.tracks:
+            parts.append(_int.pack(ALL_TRACKS))
+        else:
+            _ints(parts, [index[id(track)] for track in disc.tracks])
+
+    payload = b''.join(parts)
+    return (ALBUM_CACHE_MAGIC + _int.pack(ALBUM_CACHE_VERSION) + _int.pack(len(payload)) +
+            payload)
+
+def decodeAlbum(data):
+    """Decode cache data.  Returns (album, path, size, mtime_ns).
+    Raises AlbumCacheError if the data is not a cached album of this
+    version.
+
+    """
+    data = memoryview(data)
+    if (len(data) < 12) or (data[0:4] != ALBUM_CACHE_MAGIC):
+        raise AlbumCacheError('not an album cache file')
+    if _int.unpack_from(data, 4)[0] != ALBUM_CACHE_VERSION:
+        raise AlbumCacheError('album cache file version %d'%_int.unpack_from(data, 4)[0])
+    if _int.unpack_from(data, 8)[0] != len(data)-12:
+        raise AlbumCacheError('truncated album cache file')
+    try:
+        return _decodePayload(data, 12)
+    except (IndexError, ValueError, struct.error) as err:
+        raise AlbumCacheError('corrupt album cache file (%s)'%err) from err
+
+def _decodePayload(data, position):
+
+    def blob():
+        nonlocal position
+        length = _int.unpack_from(data, position)[0]
+        position += 4
+        if position+length > len(data):
+            raise IndexError('field runs past the end')
+        value = data[position:position+length]
+        position += length
+        return value
+
+    def string():
+        return str(blob(), 'utf-8')
+
+    def ints(count=None):
+        nonlocal position
+        if count is None:
+            count = _int.unpack_from(data, position)[0]
+            position += 4
+        values = list(intStruct(count).unpack_from(data, position))
+        position += 4*count
+        return values
+
+    size = _long.unpack_from(data, position)[0]
+    mtime_ns = _long.unpack_from(data, position+8)[0]
+    position += 16
+    path = string()
+
+    album = Album()
+    for name in ALBUM_STRINGS:
+        setattr(album, name, string())
+    album.disc_count = ints(1)[0]
+    for name in ALBUM_LISTS:
+        setattr(album, name, ints())
+    album.hex_value = bytes(blob())
+
+    tracks = []
+    nalbum = ints(1)[0]
+    nnumbers = len(TRACK_NUMBERS)
+    for cnt in range(ints(1)[0]):
+        track = Track()
+        for name in TRACK_STRINGS:
+            setattr(track, name, string())
+        numbers = ints(nnumbers + 7)
+        for name, value in zip(TRACK_NUMBERS, numbers):
+            setattr(track, name, value)
+        track.frames = numbers[nnumbers:]
+        track.filter_tag = bytes(blob())
+        track.filter_data = bytes(blob())
+        tracks.append(track)
+    album.tracks.extend(tracks[:nalbum])
+
+    for cnt in range(ints(1)[0]):
+        disc = Disc(string())
+        disc.discno = ints(1)[0]
+        if _int.unpack_from(data, position)[0] == ALL_TRACKS:
+            position += 4
+            disc.tracks = album.tracks
+        else:
+            disc.tracks = [tracks[index] for index in ints()]
+        album.discs.append(disc)
+    return album, path, size, mtime_ns
+
+def albumCacheFile(filename, cachedir=None):
+    """The cache file for the .nra file filename."""
+    key = hashlib.sha1(os.path.abspath(filename).encode('utf-8')).hexdigest()
+    return os.path.join(cachedir or defaultCachePath('albums'), key[:2], key + '.nrac')
+
+def readNeroFileCached(filename, cachedir=None):
+    """Same as readNeroFile(filename, trace=None) but the album comes
+    from the cache when the file has not changed since it was cached.
+    Otherwise the file is parsed and the cache brought up to date.
+
+    """
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    cachefile = albumCacheFile(path, cachedir)
+    try:
+        with open(cachefile, 'rb') as file:
+            album, cached_path, size, mtime_ns = decodeAlbum(file.read())
+        if (cached_path == path) and (size == stat.st_size) and (mtime_ns == stat.st_mtime_ns):
+            return album
+    except (OSError, AlbumCacheError):
+        pass
+
+    album = readNeroFile(filename, trace=None, mapped=True)
+    data = encodeAlbum(album, path, stat.st_size, stat.st_mtime_ns)
+    try:
+        os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+        tmpfile = '%s.%d.tmp'%(cachefile, os.getpid())
+        with open(tmpfile, 'wb') as file:
+            file.write(data)
+        os.replace(tmpfile, cachefile)
+    except OSError:
+        # The cache is only an optimization.
+        pass
+    return album
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", help="directories or .nra files to cache", nargs='+')
+    parser.add_argument("--cachedir", help="cache directory")
+    args = parser.parse_args()
+
+    nfiles = 0
+    for top in args.paths:
+        for filename in findNeroFiles(top):
+            try:
+                readNeroFileCached(filename, args.cachedir)
+                nfiles += 1
+            except (NeroFileError, OSError) as err:
+                print(filename + ':', err, file=sys.stderr)
+    print(nfiles, 'files cached', file=sys.stderr)
@@ -2,7 +2,27 @@
 
 """
 
-class Track:
+from array import array
+
+# Positions of the named values in Track.frames.
+FRAME_TRACK_LENGTH = 2
+FRAME_SILENCE      = 4
+FRAME_TRACK_END    = 5
+FRAME_TRACK_START  = 6
+
+# Every attribute of a track.
+TRACK_FIELDS = ('artist_name', 'track_name', 'album_name', 'performer', 'isrc',
+                'file_name', 'linux_file_name', 'track_count', 'track_number',
+                'disc_count', 'disc_number', 'track_year', 'frames', 'protection',
+                'filter_tag', 'filter_data', 'loudness')
+
+class TrackBase:
+    """The attributes and methods of a track.  Use Track, or CompactTrack
+    when memory matters.
+
+    """
+    __slots__ = ()
+
     def __init__(self):
         self.artist_name     = ''
         self.track_name      = ''
@@ -17,6 +37,18 @@ class Track:
         self.disc_number     = 0
         self.track_year      = ''
 
+        # Fields carried in the track (GULP) section of a .nra file.
+        # frames holds the seven frame ints in file order: two unknowns,
+        # track length, an unknown, silence length, track end and track
+        # start.  All in CD-DA frames (75 per second).
+        self.frames          = [0,0,0,0,0,0,0]
+        self.protection      = 0x40
+        self.filter_tag      = b'ENON'
+        self.filter_data     = b'\x00'*8
+
+        # Set by audioutils.measureTrackLoudness.
+        self.loudness        = None
+
     def __str__(self):
         return self.track_name
     def __repr__(self):
@@ -45,7 +77,17 @@ class Track:
         self.track_year = my_year
     def ISRC(self,isrc):
         self.isrc = str(isrc)
-        
+
+class Track(TrackBase):
+    """A track.  Attributes can be added freely."""
+
+class CompactTrack(TrackBase):
+    """A track without a per-instance __dict__.  Only the attributes in
+    TRACK_FIELDS can be set.
+
+    """
+    __slots__ = TRACK_FIELDS
+
 class Disc:
     def __init__(self,title):
         self.title  = title
@@ -70,6 +112,14 @@ class Album:
         self.discs      = []
         self.tracks     = []
 
+        # Option blocks from a .nra file.  See readnerofile for what is
+        # known about the individual values.
+        self.cd_options           = []
+        self.track_flags          = []
+        self.hex_value            = b''
+        self.global_track_options = []
+        self.burn_options         = []
+
     def __str__(self):
         return self.artist + ' ' + self.title
     def __repr__(self):
@@ -87,3 +137,142 @@ class Album:
             print('    ', 'composer:       ', track.artist_name)
             print('    ', 'ISRC:           ', track.isrc)
         
+
+class TrackTable:
+    """A columnar table of tracks.  Numeric fields are kept in typed
+    arrays and strings in lists.  The strings of fields that repeat a
+    lot (artist and album names and so on) are shared through a pool,
+    titles, ISRCs and file names are mostly unique and are kept as they
+    are.  frames holds the seven frame ints of every track back to back
+    and loudness the results of audioutils.measureTrackLoudness.
+
+    Rows come back as CompactTrack objects.  fromAlbum and toAlbum
+    convert to and from the usual objects, where and select filter a
+    table without building any tracks.
+
+    """
+    NUMERIC_FIELDS = ('track_count', 'track_number', 'disc_count', 'disc_number', 'protection')
+    STRING_FIELDS  = ('artist_name', 'track_name', 'album_name', 'performer', 'isrc',
+                      'file_name', 'linux_file_name', 'track_year', 'filter_tag', 'filter_data')
+    POOLED_FIELDS  = ('artist_name', 'album_name', 'performer', 'track_year',
+                      'filter_tag', 'filter_data')
+    OBJECT_FIELDS  = ('loudness',)
+
+    def __init__(self):
+        self.columns = {}
+        for name in self.NUMERIC_FIELDS:
+            self.columns[name] = array('I')
+        for name in self.STRING_FIELDS + self.OBJECT_FIELDS:
+            self.columns[name] = []
+        self.frames = array('I')
+        self._pool = {}
+
+    def __len__(self):
+        return len(self.frames)//7
+
+    def __getitem__(self, index):
+        return self.track(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.track(index)
+
+    def column(self, name):
+        """The column for a field, or the values of one frame field
+        when name is an index into Track.frames.
+
+        """
+        if isinstance(name, int):
+            return self.frames[name::7]
+        return self.columns[name]
+
+    def append(self, track):
+        """Add a Track (or anything with the same attributes)."""
+        pool = self._pool
+        for name in self.NUMERIC_FIELDS:
+            self.columns[name].append(getattr(track, name))
+        for name in self.STRING_FIELDS:
+            value = getattr(track, name)
+            if name in self.POOLED_FIELDS:
+                value = pool.setdefault(value, value)
+            self.columns[name].append(value)
+        for name in self.OBJECT_FIELDS:
+            self.columns[name].append(getattr(track, name, None))
+        self.frames.extend(track.frames)
+
+    def extend(self, tracks):
+        for track in tracks:
+            self.append(track)
+
+    def track(self, index, cls=CompactTrack):
+        """Build the track at index as a cls object."""
+        if index < 0:
+            index = index + len(self)
+        track = cls()
+        for name in self.NUMERIC_FIELDS + self.STRING_FIELDS + self.OBJECT_FIELDS:
+            setattr(track, name, self.columns[name][index])
+        track.frames = self.frames[7*index:7*index+7].tolist()
+        return track
+
+    def indices(self, name, predicate):
+        """The rows for which predicate is true of the value in a column."""
+        return [index for index, value in enumerate(self.column(name)) if predicate(value)]
+
+    def select(self, indices):
+        """A new table with just the given rows, in the given order."""
+        table = TrackTable()
+        table._pool = self._pool
+        for name in self.NUMERIC_FIELDS + self.STRING_FIELDS + self.OBJECT_FIELDS:
+            column = self.columns[name]
+            table.columns[name].extend([column[index] for index in indices])
+        frames = self.frames
+        for index in indices:
+            table.frames.extend(frames[7*index:7*index+7])
+        return table
+
+    def where(self, name, predicate):
+        """A new table with the rows for which predicate is true of the
+        value in a column.
+
+        """
+        return self.select(self.indices(name, predicate))
+
+    @classmethod
+    def fromAlbum(cls, album):
+        """Build a table from the tracks of every disc of an Album, or
+        from Album.tracks if it has no discs.  Tracks without a disc
+        number get the number of the disc they are on.
+
+        """
+        table = cls()
+        if album.discs:
+            for discidx, disc in enumerate(album.discs):
+                discno = disc.discno or discidx+1
+                for track in disc.tracks:
+                    table.append(track)
+                    if track.disc_number == 0:
+                        table.columns['disc_number'][-1] = discno
+        else:
+            table.extend(album.tracks)
+        return table
+
+    def toAlbum(self, album=None, cls=Track):
+        """Fill in the discs and tracks of an Album (a new one if none is
+        given) from the table.  Tracks are grouped into discs by
+        disc_number.
+
+        """
+        if album is None:
+            album = Album()
+        discs = {}
+        for index in range(len(self)):
+            track = self.track(index, cls)
+            if track.disc_number not in discs:
+                disc = Disc('disc %d'%track.disc_number)
+                disc.discno = track.disc_number
+                discs[track.disc_number] = disc
+            discs[track.disc_number].tracks.append(track)
+            album.tracks.append(track)
+        album.discs.extend([discs[discno] for discno in sorted(discs)])
+        album.disc_count = max(album.disc_count, len(album.discs))
+        return album
@@ -0,0 +1,341 @@
+#!/usr/bin/python3
+
+"""
+Compile Nero project (.nra) files from a SQLite database of tracks.
+
+One query is run over one connection and its rows are fetched a
+chunk at a time.  The query names its columns after the fields below
+and is ordered by album, so the rows of each album come together:
+
+  album                 anything that tells one album from the next
+  album_title, album_artist, copyright, author, mcn, rdate, comment
+                        the CD text of the album, taken from its first row
+  disc_number           the disc the track is on, 1 if left out
+  track_number          the order of the tracks on a disc
+  file_name, linux_file_name, track_name, artist_name, album_name,
+  performer, isrc, track_year
+                        the Track attributes of the same names
+
+Columns that are left out get the usual defaults.  Each disc is
+written to its own .nra file by a pool of worker processes while
+later rows are still being read.
+
+Given a BuildState, only discs whose fingerprint has changed are
+written.  The fingerprint covers the CD text and track fields of the
+disc and the size and modification time of every wavefile on it, so
+an edit to the database or a replaced wavefile rebuilds just the
+projects it affects.  With --watch the database, the wavefiles and
+the outputs of the last pass are checked every so many seconds and,
+if any of them changed, the query is run again and whatever changed
+is rebuilt.  Each check costs a stat of every one of those files.
+
+"""
+
+import os
+import sys
+import json
+import time
+import struct
+import hashlib
+import sqlite3
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from cdutils import Album, Disc, Track
+from writenerofile import writeNeroFile, encodeCdText
+
+DEFAULT_QUERY = 'SELECT * FROM tracks ORDER BY album, disc_number, track_number'
+
+# Album attributes and the columns they come from.
+ALBUM_COLUMNS = {'album_title': 'title', 'album_artist': 'artist', 'copyright': 'copyright',
+                 'author': 'author', 'mcn': 'mcn', 'rdate': 'rdate', 'comment': 'comment'}
+
+# Track attributes that are taken from columns of the same name.
+TRACK_COLUMNS = ('file_name', 'linux_file_name', 'track_name', 'artist_name', 'album_name',
+                 'performer', 'isrc', 'track_year')
+
+# Bump this when the output for the same input changes, so everything
+# is rebuilt.
+BUILD_VERSION = 1
+
+def discFingerprint(album, discno):
+    """A digest of everything the .nra file of one disc is built from.
+
+    """
+    tracks = album.discs[discno-1].tracks
+    fields = [BUILD_VERSION, discno, len(album.discs)]
+    fields.append([getattr(album, name) for name in sorted(ALBUM_COLUMNS.values())])
+    for track in tracks:
+        fields.append([getattr(track, name) for name in TRACK_COLUMNS] +
+                      [track.track_number, track.track_count,
+                       track.disc_number, track.disc_count])
+        try:
+            stat = os.stat(track.linux_file_name)
+            fields.append([stat.st_size, stat.st_mtime_ns])
+        except OSError:
+            fields.append(None)
+    return hashlib.sha1(json.dumps(fields).encode('utf-8')).hexdigest()
+
+class BuildState:
+    """The fingerprint each output file was last built from, kept in a
+    SQLite database.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self._db  = sqlite3.connect(path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS build_state_v%d '
+                         '(output TEXT PRIMARY KEY, fingerprint TEXT)'%BUILD_VERSION)
+
+    def changed(self, output, fingerprint):
+        """True if output is missing or was built from something else."""
+        if not os.path.exists(output):
+            return True
+        row = self._db.execute('SELECT fingerprint FROM build_state_v%d WHERE output = ?'
+                               %BUILD_VERSION, (os.path.abspath(output),)).fetchone()
+        return (row is None) or (row[0] != fingerprint)
+
+    def record(self, output, fingerprint):
+        self._db.execute('INSERT OR REPLACE INTO build_state_v%d VALUES (?, ?)'%BUILD_VERSION,
+                         (os.path.abspath(output), fingerprint))
+
+    def forget(self, output):
+        self._db.execute('DELETE FROM build_state_v%d WHERE output = ?'%BUILD_VERSION,
+                         (os.path.abspath(output),))
+
+    def commit(self):
+        self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def fetchRows(connection, query=DEFAULT_QUERY, params=(), chunksize=1000):
+    """Run query and generate its rows as dictionaries, fetching
+    chunksize rows at a time.
+
+    """
+    cursor = connection.execute(query, params)
+    try:
+        names = [column[0] for column in cursor.description]
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(zip(names, row))
+    finally:
+        cursor.close()
+
+def albumsFromRows(rows):
+    """Group rows from fetchRows into albums.  Generates (key, Album)
+    as each album is complete, where key is the album column.
+
+    """
+    album = None
+    key = None
+    for row in rows:
+        if (album is None) or (row.get('album') != key):
+            if album is not None:
+                yield key, _finishAlbum(album)
+            key = row.get('album')
+            album = Album()
+            for column, name in ALBUM_COLUMNS.items():
+                if row.get(column) is not None:
+                    setattr(album, name, str(row[column]))
+            discs = {}
+
+        discno = int(row.get('disc_number') or 1)
+        disc = discs.get(discno)
+        if disc is None:
+            disc = Disc('disc %d'%discno)
+            disc.discno = discno
+            discs[discno] = disc
+            album.discs.append(disc)
+
+        track = Track()
+        for name in TRACK_COLUMNS:
+            if row.get(name) is not None:
+                setattr(track, name, str(row[name]))
+        track.discNumber(discno)
+        track.trackNumber(row.get('track_number') or len(disc.tracks)+1)
+        disc.tracks.append(track)
+
+    if album is not None:
+        yield key, _finishAlbum(album)
+
+def _finishAlbum(album):
+    album.discs.sort(key=lambda disc: disc.discno)
+    album.disc_count = len(album.discs)
+    for disc in album.discs:
+        for track in disc.tracks:
+            track.trackCount(len(disc.tracks))
+            track.discCount(album.disc_count)
+            album.tracks.append(track)
+    return album
+
+def _compileDisc(album, discno, filename, cdtext):
+    try:
+        with open(filename, 'wb') as file:
+            return filename, writeNeroFile(album, discno, file, cdtext=cdtext), None
+    except (OSError, ValueError, KeyError, struct.error, sqlite3.Error) as err:
+        # Don't leave half a project behind.
+        if os.path.exists(filename):
+            os.remove(filename)
+        return filename, None, str(err)
+
+def compileNeroFiles(albums, pattern='{album}-{disc}.nra', workers=None, window=None,
+                     state=None):
+    """Write one .nra file per disc of each (key, Album) from albums.
+    The file name is pattern formatted with album (the key), title and
+    disc (the disc number).  Generates (filename, nbytes, error) in
+    order, where nbytes is None and error describes the problem if the
+    disc could not be written.  At most window discs are queued at once.
+
+    With a BuildState only discs whose fingerprint changed are written,
+    the others come back with nbytes and error both None.
+
+    """
+    fingerprints = {}
+    def jobs():
+        for key, album in albums:
+            cdtext = None
+            for index, disc in enumerate(album.discs):
+                filename = pattern.format(album=key, title=album.title, disc=disc.discno)
+                if state is not None:
+                    fingerprint = discFingerprint(album, index+1)
+                    if not state.changed(filename, fingerprint):
+                        yield None, None, filename, None
+                        continue
+                    fingerprints[filename] = fingerprint
+                if cdtext is None:
+                    cdtext = encodeCdText(album)
+                yield album, index+1, filename, cdtext
+
+    def finish(result):
+        filename, nbytes, error = result
+        if (state is not None) and (nbytes is not None):
+            state.record(filename, fingerprints.pop(filename))
+        elif state is not None:
+            fingerprints.pop(filename, None)
+            if error is not None:
+                state.forget(filename)
+        return result
+
+    workers = workers or os.cpu_count() or 1
+    window = window or 4*workers
+    if workers == 1:
+        for job in jobs():
+            if job[0] is None:
+                yield job[2], None, None
+            else:
+                yield finish(_compileDisc(*job))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for job in jobs():
+                if job[0] is None:
+                    pending.append((job[2], None, None))
+                else:
+                    pending.append(pool.submit(_compileDisc, *job))
+                if len(pending) >= window:
+                    yield _result(pending.popleft(), finish)
+            while pending:
+                yield _result(pending.popleft(), finish)
+    if state is not None:
+        state.commit()
+
+def _result(item, finish):
+    if isinstance(item, tuple):
+        return item
+    return finish(item.result())
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("database", help="SQLite database file")
+    parser.add_argument("--query", help="query giving the tracks, ordered by album",
+                        default=DEFAULT_QUERY)
+    parser.add_argument("--output", help="output file names, formatted with {album}, "
+                        "{title} and {disc}", default='{album}-{disc}.nra')
+    parser.add_argument("--workers", help="number of worker processes", type=int)
+    parser.add_argument("--chunksize", help="rows fetched at a time", type=int, default=1000)
+    parser.add_argument("--incremental", help="only rebuild changed discs, keeping track "
+                        "of what was built in this SQLite file")
+    parser.add_argument("--watch", help="check for changes every so many seconds "
+                        "(needs --incremental)", type=float)
+    args = parser.parse_args()
+
+    if (args.watch is not None) and not args.incremental:
+        print('--watch needs --incremental', file=sys.stderr)
+        sys.exit(1)
+    state = BuildState(args.incremental) if args.incremental else None
+
+    # Files whose change means another pass is needed.
+    watched = set()
+
+    def snapshot():
+        stats = []
+        for path in sorted(watched):
+            try:
+                stat = os.stat(path)
+                stats.append((path, stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                stats.append((path, None, None))
+        return stats
+
+    def albums(rows):
+        for key, album in albumsFromRows(rows):
+            watched.update(track.linux_file_name for track in album.tracks)
+            yield key, album
+
+    def build():
+        watched.clear()
+        watched.update([args.database, args.database + '-wal'])
+        connection = sqlite3.connect(args.database)
+        try:
+            rows = fetchRows(connection, args.query, chunksize=args.chunksize)
+            nfiles = 0
+            nbuilt = 0
+            nfailed = 0
+            for filename, nbytes, error in compileNeroFiles(albums(rows), args.output,
+                                                            args.workers, state=state):
+                watched.add(filename)
+                nfiles += 1
+                if nbytes is not None:
+                    nbuilt += 1
+                if error is not None:
+                    nfailed += 1
+                    if filename not in error:
+                        error = filename + ': ' + error
+                    print(error, file=sys.stderr)
+        finally:
+            connection.close()
+        print(nfiles, 'discs,', nbuilt, 'compiled,', nfailed, 'failed', file=sys.stderr)
+        return nfailed
+
+    nfailed = 0
+    try:
+        nfailed = build()
+        before = snapshot()
+        while args.watch is not None:
+            time.sleep(args.watch)
+            now = snapshot()
+            if now != before:
+                nfailed = build()
+                before = snapshot()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if state is not None:
+            state.close()
+    sys.exit(1 if nfailed else 0)
@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+
+"""
+Show what differs between Nero project (.nra) files.
+
+Both files are cut into their sections (header, CD text, CD options,
+one GULP section per track and BUST) by following the length fields,
+see readNeroLayout.  Sections are first compared as plain byte runs
+and only the ones that differ are decoded and compared field by
+field, so identical parts cost a memory compare.  A reference project
+is laid out and decoded once, so comparing it against many variants
+only costs the work on the variants.
+
+"""
+
+import sys
+import argparse
+
+from cdutils import FRAME_TRACK_LENGTH, FRAME_SILENCE, FRAME_TRACK_END, FRAME_TRACK_START
+from readnerofile import readNeroLayout, neroRegions, LazyAlbum, NeroFileError
+from editnerofile import CD_TEXT_FIELDS
+from scannerofiles import findNeroFiles
+
+OPTION_FIELDS = ('cd_options', 'track_flags', 'hex_value', 'global_track_options')
+
+TRACK_FIELDS = ('file_name', 'artist_name', 'track_name', 'isrc', 'protection',
+                'filter_tag', 'filter_data')
+
+FRAME_NAMES = {FRAME_TRACK_LENGTH: 'track length', FRAME_SILENCE: 'silence length',
+               FRAME_TRACK_END: 'track end', FRAME_TRACK_START: 'track start'}
+
+class NeroReference:
+    """A .nra file to compare others against.  Its layout is found once
+    and its fields are decoded the first time they are needed.
+
+    """
+    def __init__(self, nradata, filename=''):
+        self.filename = filename
+        self.nradata  = bytes(nradata)
+        self.layout   = readNeroLayout(self.nradata, filename)
+        self.sections = _sections(self.nradata, self.layout)
+        self._album   = None
+
+    @property
+    def album(self):
+        if self._album is None:
+            self._album = LazyAlbum(self.nradata, self.filename, layout=self.layout)
+        return self._album
+
+    def diff(self, nradata, filename=''):
+        """Compare nradata with the reference.  Returns a list of
+        (section, field, reference value, other value), empty if the
+        two are the same.
+
+        """
+        if nradata == self.nradata:
+            return []
+        layout = readNeroLayout(nradata, filename)
+        sections = _sections(nradata, layout)
+        differs = set(label for label, data in sections.items()
+                      if self.sections.get(label) != data)
+        differs.update(label for label in self.sections if label not in sections)
+        if not differs:
+            return []
+
+        other = LazyAlbum(nradata, filename, layout=layout)
+        album = self.album
+        differences = []
+        def compare(section, field, value, other_value):
+            if value != other_value:
+                differences.append((section, field, value, other_value))
+
+        if 'header' in differs:
+            compare('header', 'track options length', self.layout.track_option_length,
+                    layout.track_option_length)
+        if 'CD text' in differs:
+            for field in CD_TEXT_FIELDS:
+                compare('CD text', field, getattr(album, field), getattr(other, field))
+        if 'CD options' in differs:
+            compare('CD options', 'track count', self.layout.num_tracks, layout.num_tracks)
+            for field in OPTION_FIELDS:
+                compare('CD options', field, getattr(album, field), getattr(other, field))
+
+        num_tracks = max(self.layout.num_tracks, layout.num_tracks)
+        gulps = [index for index in range(num_tracks) if 'GULP %d'%(index+1) in differs]
+        for index in gulps:
+            section = 'GULP %d'%(index+1)
+            if index >= layout.num_tracks:
+                compare(section, 'track', album.tracks[index].track_name, None)
+                continue
+            if index >= self.layout.num_tracks:
+                compare(section, 'track', None, other.tracks[index].track_name)
+                continue
+            track, other_track = album.tracks[index], other.tracks[index]
+            for field in TRACK_FIELDS:
+                compare(section, field, getattr(track, field), getattr(other_track, field))
+            for frame, (value, other_value) in enumerate(zip(track.frames, other_track.frames)):
+                compare(section, FRAME_NAMES.get(frame, 'frame %d'%frame), value, other_value)
+
+        if gulps:
+            names = [track.file_name for track in album.tracks]
+            other_names = [track.file_name for track in other.tracks]
+            if (names != other_names) and (sorted(names) == sorted(other_names)):
+                differences.append(('tracks', 'order', names, other_names))
+
+        if 'BUST' in differs:
+            for index, (value, other_value) in enumerate(zip(album.burn_options,
+                                                             other.burn_options)):
+                compare('BUST', 'burn option %d'%index, value, other_value)
+            compare('BUST', 'tail', self.nradata[-8:], bytes(nradata[-8:]))
+
+        # Bytes no field above covers (the second copies of the file
+        # name, the track number, the unknown bytes) still count.
+        found = set(difference[0] for difference in differences)
+        for label in sorted(differs - found):
+            data = self.sections.get(label, b'')
+            other_data = sections.get(label, b'')
+            offset = next((index for index, (byte, other_byte) in
+                           enumerate(zip(data, other_data)) if byte != other_byte),
+                          min(len(data), len(other_data)))
+            differences.append((label, 'bytes at %d'%offset, bytes(data[offset:offset+8]),
+                                bytes(other_data[offset:offset+8])))
+        return differences
+
+def _sections(nradata, layout):
+    return dict((label, nradata[start:end]) for start, end, label in neroRegions(layout))
+
+def diffNeroFiles(reference, filenames):
+    """Compare the .nra file reference with each of filenames.
+    Generates (filename, differences, error) where differences is as
+    returned by NeroReference.diff, or None with error describing the
+    problem if the file could not be read.
+
+    """
+    with open(reference, 'rb') as file:
+        reference = NeroReference(file.read(), reference)
+    for filename in filenames:
+        try:
+            with open(filename, 'rb') as file:
+                nradata = file.read()
+            yield filename, reference.diff(nradata, filename), None
+        except (NeroFileError, OSError) as err:
+            yield filename, None, str(err)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("reference", help="Nero nra file to compare against")
+    parser.add_argument("paths", help="directories or .nra files to compare", nargs='+')
+    parser.add_argument("--quiet", help="only name the files that differ", action="store_true")
+    args = parser.parse_args()
+
+    filenames = (filename for top in args.paths for filename in findNeroFiles(top))
+    nfiles = 0
+    ndiffer = 0
+    for filename, differences, error in diffNeroFiles(args.reference, filenames):
+        nfiles += 1
+        if error is not None:
+            ndiffer += 1
+            print(error if filename in error else filename + ': ' + error, file=sys.stderr)
+            continue
+        if differences:
+            ndiffer += 1
+            print(filename)
+            if not args.quiet:
+                for section, field, value, other_value in differences:
+                    print('  %-10s %-22s %r -> %r'%(section, field, value, other_value))
+    print(nfiles, 'files compared,', ndiffer, 'differ', file=sys.stderr)
+    sys.exit(1 if ndiffer else 0)
@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+
+"""
+Change the CD text or track text of an existing Nero project (.nra)
+file without rebuilding it.
+
+The strings are found by following the length fields (see
+readNeroLayout in readnerofile), nothing else is decoded and no
+wavefile is opened.  When the new string encodes to the same number of
+bytes as the old one only that string is written back.  Otherwise the
+GULP length of the track is fixed up and the file is rewritten from
+the first changed byte on.  The track options length counts bytes in
+the option block only, so it never changes.
+
+"""
+
+import sys
+import argparse
+
+from byteutils import readInt, writeInt, writeShortString, writeLongString
+from readnerofile import readNeroLayout, NeroFileError
+
+# The CD text strings in file order, named after the Album attributes.
+CD_TEXT_FIELDS = ['title', 'artist', 'copyright', 'author', 'mcn', 'rdate', 'comment']
+
+# The long strings of a track section that can be changed, named after
+# the Track attributes, and their position among the seven strings.
+TRACK_TEXT_FIELDS = {'file_name': 0, 'artist_name': 3, 'track_name': 4, 'isrc': 6}
+
+class NeroEditor:
+    """Edit the strings of a .nra file in place.  Changes are kept in
+    memory until flush or close.  Track indexes count from zero, as in
+    Album.tracks.
+
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._file    = open(filename, 'r+b')
+        try:
+            self._data  = bytearray(self._file.read())
+            self.layout = readNeroLayout(self._data, filename)
+        except BaseException:
+            self._file.close()
+            raise
+        self._dirty   = []
+        self._moved   = None
+
+    def setCdText(self, field, value):
+        """Set one of the CD_TEXT_FIELDS."""
+        if field not in CD_TEXT_FIELDS:
+            raise KeyError('unknown CD text field %r'%field)
+        if len(value) > 255:
+            raise ValueError('CD text is limited to 255 characters')
+        position = self.layout.cdtext[0]
+        for cnt in range(CD_TEXT_FIELDS.index(field)):
+            position = position + 4 + 2*self._data[position+3]
+        end = position + 4 + 2*self._data[position+3]
+        self._splice(position, end, writeShortString(value))
+        self._relayout()
+
+    def setTrackText(self, index, field, value):
+        """Set one of the TRACK_TEXT_FIELDS of a track.  Setting file_name
+        also changes the bare file name and the second copy of the full
+        name, the same way writeNeroFile does.
+
+        """
+        if field not in TRACK_TEXT_FIELDS:
+            raise KeyError('unknown track text field %r'%field)
+        if not 0 <= index < self.layout.num_tracks:
+            raise IndexError('track index %d out of range, the file has %d tracks'
+                             %(index, self.layout.num_tracks))
+        start, end = self.layout.tracks[index]
+        strings = self._trackStrings(start)
+
+        # Work from the end of the section so earlier offsets stay good.
+        changes = [(strings[TRACK_TEXT_FIELDS[field]], value)]
+        if field == 'file_name':
+            changes.append((strings[2], value[value.rfind('\\')+1:]))
+            changes.append((strings[7], value))
+        delta = 0
+        for (position, stringend), text in sorted(changes, reverse=True):
+            delta += self._splice(position, stringend, writeLongString(text))
+
+        if delta != 0:
+            position, cnt = readInt(self._data, start+4)
+            self._splice(start+4, start+8, writeInt(cnt+delta))
+            self._relayout()
+
+    def flush(self):
+        """Write the changes to the file."""
+        if self._moved is not None:
+            start = min([self._moved] + [start for start, end in self._dirty])
+            self._file.seek(start)
+            self._file.write(self._data[start:])
+            self._file.truncate(len(self._data))
+        else:
+            for start, end in self._dirty:
+                self._file.seek(start)
+                self._file.write(self._data[start:end])
+        self._file.flush()
+        self._dirty = []
+        self._moved = None
+
+    def close(self):
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _trackStrings(self, start):
+        """The (start, end) of the seven long strings of the track
+        section at start, followed by the second copy of the full file
+        name.
+
+        """
+        strings = []
+        position = start + 8
+        for cnt in range(7):
+            position, end = self._longString(position)
+            strings.append((position, end))
+            position = end
+
+        # Frame ints, track number, protection, filter tag, filter
+        # section and the mystery bytes.
+        position = position + 28 + 2 + 4 + 4
+        position, cnt = readInt(self._data, position)
+        position = position + cnt + 14
+        strings.append(self._longString(position))
+        return strings
+
+    def _longString(self, position):
+        nextpos, cnt = readInt(self._data, position)
+        return position, nextpos + 2*(cnt+1)
+
+    def _splice(self, start, end, newbytes):
+        """Replace data[start:end].  Returns the change in length."""
+        if len(newbytes) == end-start:
+            if self._data[start:end] != newbytes:
+                self._data[start:end] = newbytes
+                self._dirty.append((start, end))
+            return 0
+        self._data[start:end] = newbytes
+        if (self._moved is None) or (start < self._moved):
+            self._moved = start
+        return len(newbytes) - (end-start)
+
+    def _relayout(self):
+        if self._moved is not None:
+            self.layout = readNeroLayout(self._data, self.filename)
+
+def patchNeroFile(filename, cd_text=None, tracks=None):
+    """Apply a set of edits to one file.  cd_text maps CD_TEXT_FIELDS to
+    new values and tracks maps a track index to a dictionary of
+    TRACK_TEXT_FIELDS and values.
+
+    """
+    with NeroEditor(filename) as editor:
+        for field, value in (cd_text or {}).items():
+            editor.setCdText(field, value)
+        for index, fields in (tracks or {}).items():
+            for field, value in fields.items():
+                editor.setTrackText(index, field, value)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filename", help="Nero nra file name")
+    parser.add_argument("field", help="field to change",
+                        choices=CD_TEXT_FIELDS + sorted(TRACK_TEXT_FIELDS))
+    parser.add_argument("value", help="new value")
+    parser.add_argument("--track", help="track number (from 1) for track fields", type=int)
+    args = parser.parse_args()
+
+    try:
+        with NeroEditor(args.filename) as editor:
+            if args.field in TRACK_TEXT_FIELDS:
+                if args.track is None:
+                    print('--track is needed for', args.field, file=sys.stderr)
+                    sys.exit(1)
+                if not 1 <= args.track <= editor.layout.num_tracks:
+                    print('--track must be from 1 to', editor.layout.num_tracks, file=sys.stderr)
+                    sys.exit(1)
+                editor.setTrackText(args.track-1, args.field, args.value)
+            else:
+                editor.setCdText(args.field, args.value)
+    except NeroFileError as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
+    except (OSError, ValueError) as err:
+        print(args.filename + ':', err, file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,212 @@
+#!/usr/bin/python3
+
+"""
+Keep a searchable index of Nero project (.nra) files.
+
+The CD text and track fields of every project are kept in a SQLite
+database together with the size and modification time of the file,
+so refreshing the index only parses projects that are new or have
+changed.  An inverted index maps each word of the titles and artists,
+and each ISRC and MCN, to the projects and tracks it appears in, so a
+search is a few index lookups however many projects there are.
+
+"""
+
+import os
+import re
+import sys
+import sqlite3
+import argparse
+
+from scannerofiles import findNeroFiles, scanNeroFiles
+
+# Bump this when the tables change, the index is then built again.
+INDEX_VERSION = 1
+
+# The fields that can be searched.  Titles and artists are split into
+# words, ISRCs and MCNs are matched whole.
+SEARCH_FIELDS = ('title', 'artist', 'isrc', 'mcn')
+
+_words = re.compile(r'\w+')
+
+def searchTerms(field, text):
+    """The index terms for text in one of the SEARCH_FIELDS."""
+    if field in ('isrc', 'mcn'):
+        text = text.replace('-', '').replace(' ', '').upper()
+        return [text] if text else []
+    return _words.findall(text.lower())
+
+class NeroIndex:
+    """An index of .nra files kept in the SQLite database at path.
+    Track numbers count from 1, 0 stands for the project itself.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self._db  = sqlite3.connect(path)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS files_v%(v)d
+                (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER,
+                 title TEXT, artist TEXT, mcn TEXT, error TEXT);
+            CREATE TABLE IF NOT EXISTS tracks_v%(v)d
+                (path TEXT, track_number INTEGER, title TEXT, artist TEXT, isrc TEXT,
+                 track_length INTEGER, PRIMARY KEY (path, track_number));
+            CREATE TABLE IF NOT EXISTS terms_v%(v)d
+                (term TEXT, field TEXT, path TEXT, track_number INTEGER);
+            CREATE INDEX IF NOT EXISTS terms_v%(v)d_term ON terms_v%(v)d (term, field);
+            CREATE INDEX IF NOT EXISTS terms_v%(v)d_path ON terms_v%(v)d (path);
+            '''%{'v': INDEX_VERSION})
+
+    def refresh(self, tops, workers=None):
+        """Bring the index up to date with the .nra files below each of
+        tops.  Files that are gone are dropped.  Returns the number of
+        files parsed, dropped and failed.
+
+        """
+        found = set()
+        changed = []
+        for top in tops:
+            for filename in findNeroFiles(top):
+                filename = os.path.abspath(filename)
+                found.add(filename)
+                stat = os.stat(filename)
+                row = self._db.execute('SELECT size, mtime FROM files_v%d WHERE path = ?'
+                                       %INDEX_VERSION, (filename,)).fetchone()
+                if row != (stat.st_size, stat.st_mtime_ns):
+                    changed.append((filename, stat))
+
+        dropped = 0
+        for top in tops:
+            top = os.path.abspath(top)
+            if os.path.isdir(top):
+                top = os.path.join(top, '')
+            pattern = top.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            for (filename,) in self._db.execute("SELECT path FROM files_v%d WHERE path LIKE ? "
+                                                "ESCAPE '\\'"%INDEX_VERSION,
+                                                (pattern,)).fetchall():
+                if filename not in found:
+                    self._drop(filename)
+                    dropped += 1
+
+        failed = 0
+        stats = dict(changed)
+        for filename, records, error in scanNeroFiles([filename for filename, stat in changed],
+                                                      workers):
+            self._drop(filename)
+            stat = stats[filename]
+            if error is not None:
+                failed += 1
+                self._db.execute('INSERT INTO files_v%d VALUES (?, ?, ?, ?, ?, ?, ?)'
+                                 %INDEX_VERSION, (filename, stat.st_size, stat.st_mtime_ns,
+                                                  '', '', '', error))
+                continue
+            self._add(filename, stat, records)
+        self._db.commit()
+        return len(changed)-failed, dropped, failed
+
+    def _drop(self, filename):
+        for table in ('files', 'tracks', 'terms'):
+            self._db.execute('DELETE FROM %s_v%d WHERE path = ?'%(table, INDEX_VERSION),
+                             (filename,))
+
+    def _add(self, filename, stat, records):
+        if records:
+            first = records[0]
+            title, artist, mcn = first['disc_title'], first['disc_artist'], first['mcn']
+        else:
+            title = artist = mcn = ''
+        self._db.execute('INSERT INTO files_v%d VALUES (?, ?, ?, ?, ?, ?, NULL)'%INDEX_VERSION,
+                         (filename, stat.st_size, stat.st_mtime_ns, title, artist, mcn))
+        terms = set()
+        for field, text in (('title', title), ('artist', artist), ('mcn', mcn)):
+            for term in searchTerms(field, text):
+                terms.add((term, field, filename, 0))
+        tracks = []
+        for record in records:
+            number = record['track_number']
+            tracks.append((filename, number, record['track_title'], record['track_artist'],
+                           record['isrc'], record['track_length']))
+            for field, text in (('title', record['track_title']),
+                                ('artist', record['track_artist']),
+                                ('isrc', record['isrc'])):
+                for term in searchTerms(field, text):
+                    terms.add((term, field, filename, number))
+        self._db.executemany('INSERT INTO tracks_v%d VALUES (?, ?, ?, ?, ?, ?)'%INDEX_VERSION,
+                             tracks)
+        self._db.executemany('INSERT INTO terms_v%d VALUES (?, ?, ?, ?)'%INDEX_VERSION, terms)
+
+    def search(self, text, field=None):
+        """Find the projects and tracks matching every word of text in
+        field or, without a field, in any one of the SEARCH_FIELDS.
+        Returns a sorted list of (path, track_number) where track_number
+        is 0 for a match on the project's own title, artist or MCN.
+
+        """
+        matches = set()
+        for name in ([field] if field else SEARCH_FIELDS):
+            found = None
+            for term in set(searchTerms(name, text)):
+                rows = self._db.execute('SELECT DISTINCT path, track_number FROM terms_v%d '
+                                        'WHERE term = ? AND field = ?'%INDEX_VERSION,
+                                        (term, name)).fetchall()
+                found = set(rows) if found is None else found & set(rows)
+                if not found:
+                    break
+            if found:
+                matches |= found
+        return sorted(matches)
+
+    def project(self, filename):
+        """The indexed fields of one project as a dictionary with a list
+        of its tracks, or None if it is not in the index.
+
+        """
+        filename = os.path.abspath(filename)
+        row = self._db.execute('SELECT title, artist, mcn, error FROM files_v%d WHERE path = ?'
+                               %INDEX_VERSION, (filename,)).fetchone()
+        if row is None:
+            return None
+        project = {'path': filename, 'title': row[0], 'artist': row[1], 'mcn': row[2],
+                   'error': row[3], 'tracks': []}
+        for row in self._db.execute('SELECT track_number, title, artist, isrc, track_length '
+                                    'FROM tracks_v%d WHERE path = ? ORDER BY track_number'
+                                    %INDEX_VERSION, (filename,)):
+            project['tracks'].append({'track_number': row[0], 'title': row[1],
+                                      'artist': row[2], 'isrc': row[3],
+                                      'track_length': row[4]})
+        return project
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("index", help="SQLite index file")
+    parser.add_argument("--refresh", help="directories or .nra files to index", nargs='+')
+    parser.add_argument("--search", help="words to look for")
+    parser.add_argument("--field", help="only search this field", choices=SEARCH_FIELDS)
+    parser.add_argument("--workers", help="number of worker processes", type=int)
+    args = parser.parse_args()
+
+    with NeroIndex(args.index) as index:
+        if args.refresh:
+            parsed, dropped, failed = index.refresh(args.refresh, args.workers)
+            print(parsed, 'parsed,', dropped, 'dropped,', failed, 'failed', file=sys.stderr)
+        if args.search:
+            for filename, track_number in index.search(args.search, args.field):
+                project = index.project(filename)
+                if track_number == 0:
+                    print('%s: %s / %s'%(filename, project['artist'], project['title']))
+                else:
+                    track = project['tracks'][track_number-1]
+                    print('%s: track %d %s / %s %s'%(filename, track_number, track['artist'],
+                                                     track['title'], track['isrc']))
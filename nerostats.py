@@ -0,0 +1,69 @@
+"""
+Timing and counters for the sections of a .nra file.
+
+Pass a NeroStats object as 'stats' to readNeroFile, parseNeroFile,
+writeNeroFile or neroSections to find out where the time goes.  The
+readers and writers only look at it when one is given, so leaving it
+out costs nothing.
+
+"""
+
+import sys
+from time import perf_counter
+
+class NeroStats:
+    """Wall time, bytes processed and number of calls per section.
+
+    Sections are named 'file io', 'header', 'cd text', 'cd options',
+    'GULP', 'BUST' and, when writing, 'track strings', 'wave probe',
+    'silence' and 'loudness'.
+    If callback is given it is called with (name, seconds, nbytes) for
+    every section as it is finished.
+
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.sections = {}
+
+    def start(self):
+        """Start timing.  Returns a value to pass to lap."""
+        return perf_counter()
+
+    def lap(self, name, start, nbytes=0):
+        """Record the time since start against a section and return the
+        current time so the next section can start from it.
+
+        """
+        now = perf_counter()
+        self.add(name, now-start, nbytes)
+        return now
+
+    def add(self, name, seconds, nbytes=0, calls=1):
+        """Record a section."""
+        entry = self.sections.get(name)
+        if entry is None:
+            entry = [0, 0.0, 0]
+            self.sections[name] = entry
+        entry[0] += calls
+        entry[1] += seconds
+        entry[2] += nbytes
+        if self.callback:
+            self.callback(name, seconds, nbytes)
+
+    def reset(self):
+        self.sections = {}
+
+    def summary(self):
+        """A table of the sections, most expensive first."""
+        lines = ['%-14s %8s %12s %12s'%('section', 'calls', 'seconds', 'bytes')]
+        total = 0.0
+        for name, (calls, seconds, nbytes) in sorted(self.sections.items(),
+                                                     key=lambda item: -item[1][1]):
+            lines.append('%-14s %8d %12.6f %12d'%(name, calls, seconds, nbytes))
+            total += seconds
+        lines.append('%-14s %8s %12.6f'%('total', '', total))
+        return '\n'.join(lines)
+
+    def report(self, file=None):
+        """Print the summary."""
+        print(self.summary(), file=file or sys.stdout)
@@ -6,47 +6,175 @@ Read and interpret a Nero project file (.nra file).
 This exists for the purpose of trying to understand the .nra file
 format and as such is really noisy.  Prints everything out.
 
+parseNeroFile does the same work quietly.  It returns a fully
+populated Album and raises a NeroFileError if the file does not look
+like a Nero audio CD project.  Pass a print-like callable as 'trace'
+to get the noisy dump back.
+
 Written by Robert T. Short.
 
 """
 
 import sys
+import mmap
+import struct
 import argparse
 from math import ceil
+from contextlib import contextmanager
+from collections.abc import Sequence
 
 from cdutils import Track, Disc, Album
-from byteutils import printInHexAndText, readInt, readShortString, readLongString
-from byteutils import printInChunks, printNextBytes
+from nerostats import NeroStats
+from byteutils import readInt, readInts, readShortString, readLongString
+from byteutils import formatInHexAndText, formatInChunks, writeShortString, hexDump
+
+NERO_HEADER = 'NeroCDAV8.0.0'
+NERO_HEADER_BYTES = writeShortString(NERO_HEADER)
+
+class NeroFileError(Exception):
+    """Base class for problems found while reading a .nra file."""
+
+class NeroHeaderError(NeroFileError):
+    """The file does not start with a Nero audio CD header."""
+
+class NeroFormatError(NeroFileError):
+    """The file does not have the layout we expect."""
 
 #------------------------------------------------------------
 # Routine to step through a .nra file piece by piece.
 
-def readNeroFile(filename):
+def readNeroFile(filename, trace=print, mapped=False, stats=None):
+    """Read a .nra file and return an Album.  By default everything
+    found along the way is printed, pass trace=None to be quiet.
+
+    With mapped=True the file is memory mapped and parsed through a
+    memoryview instead of being read into a buffer.  Nothing is copied
+    except the decoded strings and a few small option blocks, so memory
+    use stays flat no matter how big the project is.
+
+    stats is an optional nerostats.NeroStats that collects the time
+    spent on each section.
+
+    """
+
+    if mapped:
+        return mapNeroFile(filename, trace, stats)
 
     # read the file into a buffer.
 
-    nradata  = open(filename, "rb").read()
+    if stats:
+        start = stats.start()
+    with open(filename, "rb") as file:
+        nradata = file.read()
+    if stats:
+        stats.lap('file io', start, len(nradata))
+
+    return parseNeroFile(nradata, filename, trace, stats)
+
+def mapNeroFile(filename, trace=None, stats=None):
+    """Memory map a .nra file and parse it without reading it into memory.
+
+    """
+    if stats:
+        start = stats.start()
+    with open(filename, "rb") as file:
+        try:
+            nramap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped.
+            raise NeroHeaderError('%s: empty file'%filename) from None
+    nradata = memoryview(nramap)
+    if stats:
+        stats.lap('file io', start)
+    try:
+        return parseNeroFile(nradata, filename, trace, stats)
+    finally:
+        nradata.release()
+        try:
+            nramap.close()
+        except BufferError:
+            # A traceback still holds a view into the map, it will be
+            # closed when that goes away.
+            pass
+
+def parseNeroFile(nradata, filename='', trace=None, stats=None):
+    """Parse the contents of a .nra file and return an Album.
+
+    If trace is given it is called like print with a description of
+    everything found.  Without it no strings are formatted at all.
+    If stats is given the time spent on each section is added to it.
+
+    """
+    with _corruptData(filename):
+        return _parseNeroData(nradata, filename, trace, stats)
+
+@contextmanager
+def _corruptData(filename):
+    """Turn the errors that reading past the end of the data or
+    decoding garbage produce into a NeroFormatError.
+
+    """
+    try:
+        yield
+    except (IndexError, struct.error, UnicodeDecodeError) as err:
+        raise NeroFormatError('%s: truncated or corrupt file (%s)'%(filename, err)) from err
+
+def _parseNeroData(nradata, filename, trace, stats):
+
+    album = Album()
+    position, num_tracks = _parseDiscOptions(nradata, album, filename, trace, stats)
+
+    disc = Disc(album.title)
+    disc.discno = 1
+    disc.tracks = album.tracks
+    album.discs.append(disc)
+    album.disc_count = 1
+
+    if stats:
+        start = stats.start()
+    for track_number in range(num_tracks):
+        nextpos, track = _parseTrack(nradata, position, album, track_number, num_tracks,
+                                     filename, trace)
+        album.tracks.append(track)
+        if stats:
+            start = stats.lap('GULP', start, nextpos-position)
+        position = nextpos
+
+    _parseBurnOptions(nradata, position, album, filename, trace)
+    if stats:
+        stats.lap('BUST', start, len(nradata)-position)
+
+    return album
+
+def _parseDiscOptions(nradata, album, filename, trace, stats=None):
+    """Parse the header, CD text and global options into album.
+    Returns the position of the first track section and the number of
+    tracks.
+
+    """
+
+    if stats:
+        start = stats.start()
     position = 0
 
     # Nero header.  See below for encoding of "short text".
     # I have only looked at audio CD projects so far.
     position,header = readShortString(nradata, position)
-    if (header != 'NeroCDAV8.0.0'):
-        print( 'invalid header' )
-        sys.exit()
-
-    album = Album()
+    if (header != NERO_HEADER):
+        raise NeroHeaderError('%s: invalid header %r'%(filename, header))
 
-    print()
-    print('------------------------------------------------------------')
-    print('File', filename, 'is a Nero compilation file', 'with', len(nradata), 'bytes')
+    if trace:
+        trace()
+        trace('------------------------------------------------------------')
+        trace('File', filename, 'is a Nero compilation file', 'with', len(nradata), 'bytes')
 
     # Integer byte field.  This seems to count from the end of
     # the CD options block (the beginning of the 32 bit int field that contains
     # the value 9) to the beginning of the track sections (the two byte field
     # containing zeros).
     position,track_option_length = readInt(nradata,position)
-    print('Track options length', track_option_length, "(0x%x)"%track_option_length)
+    if trace:
+        trace('Track options length', track_option_length, "(0x%x)"%track_option_length)
 
     # Parse the strings.  There are seven strings that are always present
     # but possibly empty.
@@ -65,33 +193,27 @@ def readNeroFile(filename):
     # These are 16 bit characters.  No clue what encoding is used.
     # The format of this text seems to be 0x.. 0x00 where .. are
     # ASCII characters for all of the stuff I have tried.
-    position,title = readShortString(nradata, position)
-    print('CD Title', title)
-    album.title = title
-
-    position,artist = readShortString(nradata, position)
-    print('CD Artist', artist)
-    album.artist = artist
-
-    position,copyright = readShortString(nradata, position)
-    print('Copyright', copyright)
-    album.copyright = copyright
-
-    position,author = readShortString(nradata, position)
-    print('Author', author)
-    album.author = author
-
-    position,mcn = readShortString(nradata, position)
-    print('MCN', mcn)
-    album.mcn = mcn
-
-    position,rdate = readShortString(nradata, position)
-    print('Date', rdate)
-    album.rdate = rdate
-
-    position,comment = readShortString(nradata, position)
-    print('Comment', comment)
-    album.comment = comment
+    if stats:
+        start = stats.lap('header', start, position)
+        section = position
+    position,album.title = readShortString(nradata, position)
+    position,album.artist = readShortString(nradata, position)
+    position,album.copyright = readShortString(nradata, position)
+    position,album.author = readShortString(nradata, position)
+    position,album.mcn = readShortString(nradata, position)
+    position,album.rdate = readShortString(nradata, position)
+    position,album.comment = readShortString(nradata, position)
+    if stats:
+        start = stats.lap('cd text', start, position-section)
+        section = position
+    if trace:
+        trace('CD Title', album.title)
+        trace('CD Artist', album.artist)
+        trace('Copyright', album.copyright)
+        trace('Author', album.author)
+        trace('MCN', album.mcn)
+        trace('Date', album.rdate)
+        trace('Comment', album.comment)
 
     # The next group of bytes are global CD options (as opposed to track
     # options).  There seems to be a fixed number of bytes, followed by
@@ -103,7 +225,7 @@ def readNeroFile(filename):
     #
     # Offset 0x10 always contains 0x0009 and seems to be the last global CD
     # option and the remaining flags are global track options.  The
-    # track_option_length variable above seems to be the number of bytes 
+    # track_option_length variable above seems to be the number of bytes
     # between the end of the 0x0009 and the count for the number of tracks.
 
     # In the following Offset is the offset in bytes from the end of the comment field.
@@ -112,7 +234,7 @@ def readNeroFile(filename):
     # 01-04    A 32 bit integer.  Always 0.
     # 05-08    A 32 bit integer.  Always 0.
     # 09-0c    The write cd text to disc flag (32 bit integer).
-    # 0d-10    A 32 bit integer.  Always 1.   
+    # 0d-10    A 32 bit integer.  Always 1.
     # 11-14    A 32 bit integer.  Always 9.  The track_option_length starts at offset 0x11.
     # 15-18    A 32 bit integer.  Always 0.
     # 19-1c    A 32 bit integer.  Always 0.
@@ -121,11 +243,11 @@ def readNeroFile(filename):
     #          The integer is always 1.
     #
     # In the following, Offset is from the end of the track fields.
-    # 00       0x0a 
+    # 00       0x0a
     # 03-0a    A large hex value
     # 0c-0f    32 bit int Normalize all tracks flag.
     # 10-13    32 bit int No pause between tracks flag
-    # 14-17    32 bit int Remove silence at end of tracks.   
+    # 14-17    32 bit int Remove silence at end of tracks.
     # 18-19    zeros.  The track_option_length ends at offset 0x18.
     # 1a       32 bit int Number of tracks (again)
 
@@ -133,85 +255,74 @@ def readNeroFile(filename):
     # is preceded by the number of tracks, and the number of tracks
     # follows the global CD and track options.
 
-    # Find the first GULP tag.
+    # Locate the first GULP tag from the track options length rather
+    # than searching for it, a search can match inside a string.
 
-    nextpos = nradata.find(b"GULP")-4
-    nbytes = nextpos-position
-    print(nbytes, "(0x%x) CD option bytes from"%nbytes, position, "to", nextpos-1)
+    global_track_position = position + 17
+    options_end = global_track_position + track_option_length
+    # A project without tracks goes straight on to the BUST section.
+    nextpos = options_end + 2
+    tag = bytes(nradata[nextpos+4:nextpos+8])
+    if (tag != b'GULP') and ((tag != b'BUST') or (readInt(nradata, nextpos)[1] != 0)):
+        raise NeroFormatError('%s: no GULP tag at offset %d'%(filename, nextpos+4))
 
-    #  Raw dump of everything up to the tag.
-    print('Bytes from end of comment to next GULP tag')
-    printInChunks(nradata[position:nextpos])
+    if trace:
+        nbytes = nextpos-position
+        trace(nbytes, "(0x%x) CD option bytes from"%nbytes, position, "to", nextpos-1)
 
-    # Skip the single zero byte.
-    print('Skipping byte with value',nradata[position], 'at position',position)
-    position = position + 1
+        #  Raw dump of everything up to the tag.
+        trace('Bytes from end of comment to next GULP tag')
+        trace(formatInChunks(nradata[position:nextpos]))
 
-    print()
-    print('Broken down CD options')
-    intlist = []
-    print( 'CD Options' )
-    for cnt in range(0,5):
-        position, myint = readInt(nradata, position)
-        intlist += [myint]
-        print( myint, end=" " )
-    print()
-    print('  -- "write cd text" is',intlist[2])
-    print()
+        # Skip the single zero byte.
+        trace('Skipping byte with value',nradata[position], 'at position',position)
+    position = position + 1
 
-    global_track_position = position-4
-    print("global_track_position", global_track_position, "(%x)"%global_track_position)
+    position, cd_options = readInts(nradata, position, 7)
+    album.cd_options = cd_options
 
-    intlist = []
-    print( 'Global Track Options' )
-    for cnt in range(2):
-        position, myint = readInt(nradata, position)
-        print( myint, end=" " )
-        intlist.append(myint)
-    print()
     position, num_tracks = readInt(nradata, position)
-    print('number of tracks', num_tracks)
-    intlist = []
-    for cnt in range(num_tracks):
-        position, myint = readInt(nradata, position)
-        intlist += [myint]
-        print( myint, end=" ")
-    print()
+    position, track_flags = readInts(nradata, position, num_tracks)
+    album.track_flags = track_flags
 
     #  The hex value.
-    print('The hex value')
-    hexvalue = nradata[position:position+12]
-    printInHexAndText(hexvalue)
+    album.hex_value = bytes(nradata[position:position+12])
     position = position + 12
 
     # More global track options.  Some of my newer projects have more bytes than the older ones.
-    print('More global track options,', nextpos-2-position, 'bytes')
-    intlist = []
-    while position < nextpos-2:
-        position, myint = readInt(nradata, position)
-        intlist += [myint]
-        print( myint, end=" " )
-    print()
-    if (len(intlist) > 0):
-        print('  -- "normalize all tracks" is',intlist[0])
-    else:
-        print('  -- "normalize all tracks" is not present')
-    if (len(intlist) > 1):
-        print('  -- "No pause between tracks" is',intlist[1])
-    else:
-        print('  -- "No pause between tracks" is not present')
-    if (len(intlist) > 2):
-        print('  -- "Remove silence at end of tracks" is',intlist[2])
-    else:
-        print('  -- "Remove silence at end of tracks" is not present')
-    print()
-
-
-    # Swallow two bytes.
-    print('End of global track options section', position, '(%x)'%position,
-          'length', position-global_track_position)
-    print('Skipping bytes with value',nradata[position:position+2],
-          'at position',position,"(%x)"%position)
+    position, global_track_options = readInts(nradata, position, (options_end-position)//4)
+    album.global_track_options = global_track_options
+
+    if trace:
+        trace()
+        trace('Broken down CD options')
+        trace( 'CD Options' )
+        trace(*cd_options[0:5])
+        trace('  -- "write cd text" is',cd_options[2])
+        trace()
+        trace("global_track_position", global_track_position, "(%x)"%global_track_position)
+        trace( 'Global Track Options' )
+        trace(*cd_options[5:7])
+        trace('number of tracks', num_tracks)
+        trace(*track_flags)
+        trace('The hex value')
+        trace(formatInHexAndText(album.hex_value))
+        trace('More global track options,', 4*len(global_track_options), 'bytes')
+        trace(*global_track_options)
+        names = ['normalize all tracks', 'No pause between tracks',
+                 'Remove silence at end of tracks']
+        for idx,name in enumerate(names):
+            if (len(global_track_options) > idx):
+                trace('  -- "%s" is'%name, global_track_options[idx])
+            else:
+                trace('  -- "%s" is not present'%name)
+        trace()
+
+        # Swallow two bytes.
+        trace('End of global track options section', position, '(%x)'%position,
+              'length', position-global_track_position)
+        trace('Skipping bytes with value',bytes(nradata[position:position+2]),
+              'at position',position,"(%x)"%position)
     position = position + 2
 
     # The next big chunk is track information.  At least up to the "BUST" tag.
@@ -219,122 +330,137 @@ def readNeroFile(filename):
     # tag the number of bytes up to the next section.
 
     # The beginning of the track section.
-    print()
-    print('Track section header')
     position, num_tracks_again = readInt(nradata, position)
-    print('Number of tracks',num_tracks_again)
+    if trace:
+        trace()
+        trace('Track section header')
+        trace('Number of tracks',num_tracks_again)
 
-    for track_number in range(num_tracks_again):
-        track = Track()
-        album.tracks.append(track)
-        
-        print('Track number',track_number+1)
-
-        track_header = nradata[position:position+4]
-        position = position + 4
-        position,cnt = readInt(nradata, position)
-        next_section = position+cnt
-        print('Track header', track_header, 'offset to next header', cnt, "(0x%x)"%cnt)
-        print('bytes at next header',end=' ')
-        printInHexAndText(nradata[next_section:next_section+8])
-
-        #  The next chunk is track information.
-        #  There are 7 strings.  Each string starts with a 32 bit count, is composed of
-        #  16 bit chars (as in the CD section) and a 16 bit null trailer.
-
-        # Full file name.
-        position, full_file_name = readLongString(nradata,position)
-        print('Full file name "',full_file_name,'"',sep='')
-
-        # Empty string.
-        position, empty_string = readLongString(nradata,position)
-        print('Empty string "', empty_string, '"', sep='')
-
-        # File name.
-        position, file_name = readLongString(nradata,position)
-        print('File name "', file_name, '"', sep='')
-
-        # Artist
-        position, artist = readLongString(nradata,position)
-        print('Artist "', artist, '"', sep='')
-        track.artistName(artist)
-
-        # Track title
-        position, track_title = readLongString(nradata,position)
-        print('Track title "', track_title, '"', sep='')
-        track.trackName(track_title)
-
-        # Empty string.
-        position, empty_string = readLongString(nradata,position)
-        print('Empty string "', empty_string, '"', sep='')
-
-        # ISRC
-        position, isrc = readLongString(nradata,position)
-        print('ISRC "', isrc, '"', sep='')
-        track.ISRC(isrc)
-
-        # The following are hex offsets from the end of the ISRC string.
-        # Most of these are track times in (I think) CD-DA frames.  From 
-        # brief internet scan, each frame is 588 bytes and the frame rate
-        # is 75 frames/s.  I could be wrong about this but the numbers
-        # work.
-        # offset   field
-        # 0 - 3    unknown
-        # 4 - 7    unknown
-        # 8 - b    Length of track.
-        # c - f    unknown
-        # 12-15    Length of silence prepended to track.
-        # 16-19    Track start (frame at start of actual data not including silence)
-        # 1a-1b    Track end (frame at end of actual data)
-        # 1c-1d    2 byte track number.
-        # 1e-21    Protection flag.  0x40 is no protection, 0x00 is protected.
-        # 22       Filter field.  ENON is no filter.  The filter flag is
-        #          followed by a 4 byte field length.
+    if stats:
+        stats.lap('cd options', start, position-section)
 
-        print()
-        print('Track length ints')
-        intlist = []
-        for cnt in range(7):
-            position, myint = readInt(nradata, position)
-            intlist += [myint]
-            print( myint, end=" " )
-        print()
-        print('  -- "unknown" is',intlist[0], "(",intlist[0]/75.0,"s)")
-        print('  -- "unknown" is',intlist[1], "(",intlist[1]/75.0,"s)")
-        print('  -- "track length" is',intlist[2], "(",intlist[2]/75.0,"s)")
-        print('  -- "unknown" is',intlist[3], "(",intlist[3]/75.0,"s)")
-        print('  -- "silence time" is',intlist[4], "(",intlist[4]/75.0,"s)")
-        print('  -- "track end" is',intlist[5], "(",intlist[5]/75.0,"s)")
-        print('  -- "track start" is',intlist[6], "(",intlist[6]/75.0,"s)")
-        print()
-        position,trkno = readInt(nradata,position,2)
-        position,protection = readInt(nradata,position)
-        print('track number',trkno, 'protection',protection,'(%x)'%protection)
-
-        print('Filter section')
-        nextpos = position+4
-        filter_tag = nradata[position:nextpos]
-        print('filter tag', filter_tag)
-        position = nextpos
+    return position, num_tracks_again
 
-        position,cnt = readInt(nradata,position)
-        nextpos = position+cnt
-        print(cnt, 'filter section bytes', end=' ')
-        printInHexAndText(nradata[position:nextpos])
-        position = nextpos
+def _parseTrack(nradata, position, album, track_number, num_tracks, filename, trace):
+    """Parse the GULP section at position.  Returns the position of the
+    next section and the Track.
 
-        nextpos = position+14
-        print('mystery bytes ',end='')
-        printInHexAndText(nradata[position:nextpos])
-        position = nextpos
+    """
 
-        position, full_file_name_again = readLongString(nradata,position)
-        print('Full file name (again) "', full_file_name_again, '"', sep='')
+    track = Track()
+    track.track_count = num_tracks
+    track.disc_number = 1
+    track.disc_count  = 1
+    track.album_name  = album.title
 
-        nextpos = position+4
-        print('mystery bytes ',end='')
-        printInHexAndText(nradata[position:nextpos], end='\n\n')
-        position = nextpos
+    track_header = bytes(nradata[position:position+4])
+    if (track_header != b'GULP'):
+        raise NeroFormatError('%s: expected GULP tag at offset %d'%(filename, position))
+    position = position + 4
+    position,cnt = readInt(nradata, position)
+    next_section = position+cnt
+    if trace:
+        trace('Track number',track_number+1)
+        trace('Track header', track_header, 'offset to next header', cnt, "(0x%x)"%cnt)
+        trace('bytes at next header', formatInHexAndText(nradata[next_section:next_section+8]))
+
+    #  The next chunk is track information.
+    #  There are 7 strings.  Each string starts with a 32 bit count, is composed of
+    #  16 bit chars (as in the CD section) and a 16 bit null trailer.
+    #
+    #  Full file name, empty string, file name, artist, track title,
+    #  empty string, ISRC.
+    position, full_file_name = readLongString(nradata,position)
+    position, empty_string1 = readLongString(nradata,position)
+    position, file_name = readLongString(nradata,position)
+    position, artist = readLongString(nradata,position)
+    position, track_title = readLongString(nradata,position)
+    position, empty_string2 = readLongString(nradata,position)
+    position, isrc = readLongString(nradata,position)
+    track.fileName(full_file_name)
+    track.artistName(artist)
+    track.trackName(track_title)
+    track.ISRC(isrc)
+    if trace:
+        trace('Full file name "',full_file_name,'"',sep='')
+        trace('Empty string "', empty_string1, '"', sep='')
+        trace('File name "', file_name, '"', sep='')
+        trace('Artist "', artist, '"', sep='')
+        trace('Track title "', track_title, '"', sep='')
+        trace('Empty string "', empty_string2, '"', sep='')
+        trace('ISRC "', isrc, '"', sep='')
+
+    # The following are hex offsets from the end of the ISRC string.
+    # Most of these are track times in (I think) CD-DA frames.  From
+    # brief internet scan, each frame is 588 bytes and the frame rate
+    # is 75 frames/s.  I could be wrong about this but the numbers
+    # work.
+    # offset   field
+    # 0 - 3    unknown
+    # 4 - 7    unknown
+    # 8 - b    Length of track.
+    # c - f    unknown
+    # 12-15    Length of silence prepended to track.
+    # 16-19    Track start (frame at start of actual data not including silence)
+    # 1a-1b    Track end (frame at end of actual data)
+    # 1c-1d    2 byte track number.
+    # 1e-21    Protection flag.  0x40 is no protection, 0x00 is protected.
+    # 22       Filter field.  ENON is no filter.  The filter flag is
+    #          followed by a 4 byte field length.
+
+    position, frames = readInts(nradata, position, 7)
+    track.frames = frames
+    position,trkno = readInt(nradata,position,2)
+    position,protection = readInt(nradata,position)
+    track.trackNumber(trkno)
+    track.protection = protection
+    if trace:
+        trace()
+        trace('Track length ints')
+        trace(*frames)
+        names = ['unknown', 'unknown', 'track length', 'unknown',
+                 'silence time', 'track end', 'track start']
+        for name,frame in zip(names,frames):
+            trace('  -- "%s" is'%name, frame, "(",frame/75.0,"s)")
+        trace()
+        trace('track number',trkno, 'protection',protection,'(%x)'%protection)
+
+    nextpos = position+4
+    track.filter_tag = bytes(nradata[position:nextpos])
+    position = nextpos
+
+    position,cnt = readInt(nradata,position)
+    nextpos = position+cnt
+    track.filter_data = bytes(nradata[position:nextpos])
+    position = nextpos
+    if trace:
+        trace('Filter section')
+        trace('filter tag', track.filter_tag)
+        trace(cnt, 'filter section bytes', formatInHexAndText(track.filter_data))
+
+    nextpos = position+14
+    if trace:
+        trace('mystery bytes', formatInHexAndText(nradata[position:nextpos]))
+    position = nextpos
+
+    position, full_file_name_again = readLongString(nradata,position)
+
+    nextpos = position+4
+    if trace:
+        trace('Full file name (again) "', full_file_name_again, '"', sep='')
+        trace('mystery bytes', formatInHexAndText(nradata[position:nextpos]), end='\n\n')
+    position = nextpos
+
+    if (position != next_section):
+        raise NeroFormatError('%s: track %d ends at offset %d, expected %d'
+                              %(filename, track_number+1, position, next_section))
+
+    return position, track
+
+def _parseBurnOptions(nradata, position, album, filename, trace):
+    """Parse the BUST section at position into album.
+
+    """
 
     # The final section contains options relating to the disc burning.
     #
@@ -347,30 +473,232 @@ def readNeroFile(filename):
     #
     #  There are some values that could be end-of-file flags, etc.
 
-    burn_options_header = nradata[position:position+4]
+    burn_options_header = bytes(nradata[position:position+4])
+    if (burn_options_header != b'BUST'):
+        raise NeroFormatError('%s: expected BUST tag at offset %d'%(filename, position))
     position = position + 4
     position,cnt = readInt(nradata, position)
-    next_section = position+cnt
-    print()
-    print('Burn options header', burn_options_header, 'offset to next header', cnt, "(0x%x)"%cnt)
-    print('Bytes from BUST tag to end of file')
-    printInChunks(nradata[position:])
-
-    print('Burn option ints')
-    intlist = []
-    for cnt in range(26):
-        position, myint = readInt(nradata, position)
-        intlist += [myint]
-        print( "%x"%myint, end=" " )
-    print()
-    print('  -- "Disc at once" is',intlist[3])
-    print('  -- "Write" is',intlist[6])
-    print('  -- "Finalize disc" is',intlist[7])
-    print()
+    if trace:
+        trace()
+        trace('Burn options header', burn_options_header, 'offset to next header', cnt, "(0x%x)"%cnt)
+        trace('Bytes from BUST tag to end of file')
+        trace(formatInChunks(nradata[position:]))
+
+    position, burn_options = readInts(nradata, position, 26)
+    album.burn_options = burn_options
+    if trace:
+        trace('Burn option ints')
+        trace(*["%x"%myint for myint in burn_options])
+        trace('  -- "Disc at once" is',burn_options[3])
+        trace('  -- "Write" is',burn_options[6])
+        trace('  -- "Finalize disc" is',burn_options[7])
+        trace()
+        trace('Next bytes at position',position, '%x'%position)
+        trace(formatInHexAndText(nradata[position:position+8]))
 
-    printNextBytes(nradata,position,8)
 
-    return album
+#------------------------------------------------------------
+# Section layout and lazy access to tracks.
+
+class NeroLayout:
+    """Byte offsets of the sections of a .nra file.  Each section is a
+    (start, end) pair.  header covers the header string and the track
+    options length, cdtext the seven CD text strings, options
+    everything from there to the first GULP tag, tracks has one entry
+    per GULP section and bust runs from the BUST tag to the end.
+
+    """
+    def __init__(self):
+        self.size                = 0
+        self.header              = (0,0)
+        self.track_option_length = 0
+        self.cdtext              = (0,0)
+        self.options             = (0,0)
+        self.num_tracks          = 0
+        self.tracks              = []
+        self.bust                = (0,0)
+        self.bust_length         = 0
+
+def readNeroLayout(nradata, filename=''):
+    """Find the sections of a .nra file by following the length fields.
+    No strings are decoded.
+
+    """
+    with _corruptData(filename):
+        return _walkNeroLayout(nradata, filename)
+
+def _walkNeroLayout(nradata, filename):
+
+    layout = NeroLayout()
+    layout.size = len(nradata)
+
+    position = len(NERO_HEADER_BYTES)
+    if (nradata[0:position] != NERO_HEADER_BYTES):
+        raise NeroHeaderError('%s: invalid header'%filename)
+    position,layout.track_option_length = readInt(nradata, position)
+    layout.header = (0, position)
+
+    # Seven short strings, each a 4 byte preamble and a count of 16
+    # bit characters.
+    start = position
+    for cnt in range(7):
+        position = position + 4 + 2*nradata[position+3]
+    layout.cdtext = (start, position)
+
+    # The zero byte and 4 CD option ints, then the track options.
+    start = position
+    position = position + 17 + layout.track_option_length + 2
+    position,layout.num_tracks = readInt(nradata, position)
+    layout.options = (start, position)
+
+    for track_number in range(layout.num_tracks):
+        if (nradata[position:position+4] != b'GULP'):
+            raise NeroFormatError('%s: expected GULP tag at offset %d'%(filename, position))
+        nextpos,cnt = readInt(nradata, position+4)
+        layout.tracks.append((position, nextpos+cnt))
+        position = nextpos+cnt
+
+    if (nradata[position:position+4] != b'BUST'):
+        raise NeroFormatError('%s: expected BUST tag at offset %d'%(filename, position))
+    nextpos,layout.bust_length = readInt(nradata, position+4)
+    layout.bust = (position, len(nradata))
+
+    return layout
+
+def neroRegions(layout):
+    """The sections of a NeroLayout as (start, end, label) regions for
+    byteutils.hexDump.
+
+    """
+    regions = [(layout.header[0], layout.header[1], 'header'),
+               (layout.cdtext[0], layout.cdtext[1], 'CD text'),
+               (layout.options[0], layout.options[1], 'CD options')]
+    for track_number, (start, end) in enumerate(layout.tracks):
+        regions.append((start, end, 'GULP %d'%(track_number+1)))
+    regions.append((layout.bust[0], layout.bust[1], 'BUST'))
+    return regions
+
+def dumpNeroFile(filename, chunksize=16, file=None):
+    """Write an annotated hex dump of a .nra file.
+
+    """
+    with open(filename, "rb") as nrafile:
+        nradata = nrafile.read()
+    try:
+        regions = neroRegions(readNeroLayout(nradata, filename))
+    except NeroFileError:
+        # Dump what is there even if the layout can't be followed.
+        regions = None
+    hexDump(nradata, chunksize, regions, file)
+
+class LazyTrackList(Sequence):
+    """The tracks of a LazyAlbum.  A Track is decoded the first time it
+    is used and kept after that.  Assigning to an entry replaces it.
+
+    """
+    def __init__(self, album):
+        self._album  = album
+        self._tracks = [None]*album.layout.num_tracks
+
+    def __len__(self):
+        return len(self._tracks)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[idx] for idx in range(*index.indices(len(self)))]
+        track = self._tracks[index]
+        if track is None:
+            if index < 0:
+                index = index + len(self._tracks)
+            track = self._album.decodeTrack(index)
+            self._tracks[index] = track
+        return track
+
+    def __setitem__(self, index, track):
+        self._tracks[index] = track
+
+    def decoded(self):
+        """The number of tracks decoded so far."""
+        return len(self._tracks) - self._tracks.count(None)
+
+class LazyAlbum(Album):
+    """An Album read from .nra data that only decodes a track when it
+    is accessed, so album.tracks[179].track_name costs one track's
+    worth of decoding.  The CD text and options are read up front, the
+    track sections are found from their GULP length fields, or taken
+    from layout if the caller already has it from readNeroLayout.
+
+    """
+    def __init__(self, nradata, filename='', nramap=None, layout=None):
+        Album.__init__(self)
+        self.filename  = filename
+        self.layout    = layout or readNeroLayout(nradata, filename)
+        self._nradata  = nradata
+        self._nramap   = nramap
+
+        with _corruptData(filename):
+            _parseDiscOptions(nradata, self, filename, None)
+            _parseBurnOptions(nradata, self.layout.bust[0], self, filename, None)
+
+        self.tracks = LazyTrackList(self)
+        disc = Disc(self.title)
+        disc.discno = 1
+        disc.tracks = self.tracks
+        self.discs.append(disc)
+        self.disc_count = 1
+
+    def decodeTrack(self, index):
+        """Decode track index (counting from zero) from the file.
+
+        """
+        if self._nradata is None:
+            raise NeroFileError('%s: file is closed'%self.filename)
+        with _corruptData(self.filename):
+            position, track = _parseTrack(self._nradata, self.layout.tracks[index][0], self,
+                                          index, self.layout.num_tracks, self.filename, None)
+        return track
+
+    def close(self):
+        """Release a memory mapped file.  Tracks that have already been
+        decoded are still available, decoding any other track raises
+        NeroFileError.
+
+        """
+        if self._nramap is not None:
+            self._nradata.release()
+            self._nramap.close()
+            self._nramap  = None
+            self._nradata = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def openNeroFile(filename, mapped=False):
+    """Open a .nra file as a LazyAlbum.  With mapped=True the file is
+    memory mapped and stays open until the album is closed.
+
+    """
+    with open(filename, "rb") as file:
+        if not mapped:
+            return LazyAlbum(file.read(), filename)
+        try:
+            nramap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise NeroHeaderError('%s: empty file'%filename) from None
+    nradata = memoryview(nramap)
+    try:
+        return LazyAlbum(nradata, filename, nramap)
+    except BaseException:
+        nradata.release()
+        try:
+            nramap.close()
+        except BufferError:
+            # As in mapNeroFile, a traceback may still hold a view.
+            pass
+        raise
 
 if __name__ == '__main__':
 
@@ -379,10 +707,25 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("filename", help="Nero nra file name",         \
                         nargs='?', default="00Samples/Chords.nra" )
+    parser.add_argument("--mapped", help="memory map the file", action="store_true")
+    parser.add_argument("--stats", help="print time spent per section", action="store_true")
+    parser.add_argument("--hexdump", help="just print an annotated hex dump", action="store_true")
     args = parser.parse_args()
     filename = args.filename
 
-    album = readNeroFile(filename)
+    if args.hexdump:
+        dumpNeroFile(filename)
+        sys.exit(0)
+
+    stats = NeroStats() if args.stats else None
+    try:
+        album = readNeroFile(filename, mapped=args.mapped, stats=stats)
+    except NeroFileError as err:
+        print(err)
+        sys.exit(1)
     print()
     print('-----------------------------------------------------------')
     album.printAlbum()
+    if stats:
+        print()
+        stats.report()
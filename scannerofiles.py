@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+
+"""
+Scan directory trees of Nero project (.nra) files and write a catalog
+with one record per track, as JSON lines or CSV.
+
+Files are parsed quietly across a pool of processes.  Only a bounded
+number of files are in flight at once so memory use does not grow
+with the size of the tree.  A file that can't be parsed is reported on
+standard error and skipped.
+
+"""
+
+import os
+import sys
+import csv
+import json
+import struct
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from cdutils import FRAME_TRACK_LENGTH, FRAME_SILENCE, FRAME_TRACK_START, FRAME_TRACK_END
+from readnerofile import readNeroFile, NeroFileError
+
+CATALOG_FIELDS = ['path', 'disc_title', 'disc_artist', 'mcn',
+                  'track_number', 'track_title', 'track_artist', 'isrc',
+                  'track_length', 'silence_length', 'track_start', 'track_end']
+
+def findNeroFiles(top):
+    """Generate the .nra files below top in a repeatable order.
+
+    """
+    if os.path.isfile(top):
+        yield top
+        return
+    for dirpath, dirnames, filenames in os.walk(top):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith('.nra'):
+                yield os.path.join(dirpath, filename)
+
+def trackRecords(filename):
+    """Parse one .nra file and return a list of catalog records, one
+    dictionary per track.
+
+    """
+    album = readNeroFile(filename, trace=None, mapped=True)
+    records = []
+    for trackno, track in enumerate(album.tracks):
+        records.append({'path':           filename,
+                        'disc_title':     album.title,
+                        'disc_artist':    album.artist,
+                        'mcn':            album.mcn,
+                        'track_number':   trackno+1,
+                        'track_title':    track.track_name,
+                        'track_artist':   track.artist_name,
+                        'isrc':           track.isrc,
+                        'track_length':   track.frames[FRAME_TRACK_LENGTH],
+                        'silence_length': track.frames[FRAME_SILENCE],
+                        'track_start':    track.frames[FRAME_TRACK_START],
+                        'track_end':      track.frames[FRAME_TRACK_END]})
+    return records
+
+def _scanOne(filename):
+    try:
+        return filename, trackRecords(filename), None
+    except (NeroFileError, OSError, ValueError, IndexError, struct.error) as err:
+        return filename, None, str(err)
+
+def scanNeroFiles(filenames, workers=None, window=None):
+    """Parse filenames across a pool of processes.  Generates
+    (filename, records, error) in input order, where records is None and
+    error describes the problem if the file could not be parsed.  At
+    most window files are queued at once.
+
+    """
+    workers = workers or os.cpu_count() or 1
+    window = window or 4*workers
+    if workers == 1:
+        for filename in filenames:
+            yield _scanOne(filename)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for filename in filenames:
+            pending.append(pool.submit(_scanOne, filename))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def writeCatalog(results, outfile, fmt='jsonl', errfile=sys.stderr):
+    """Write the records from scanNeroFiles to outfile as they arrive.
+    Returns the number of files scanned and the number that failed.
+
+    """
+    if fmt == 'csv':
+        writer = csv.DictWriter(outfile, fieldnames=CATALOG_FIELDS)
+        writer.writeheader()
+    nfiles = 0
+    nfailed = 0
+    for filename, records, error in results:
+        nfiles += 1
+        if error is not None:
+            nfailed += 1
+            if filename not in error:
+                error = filename + ': ' + error
+            print(error, file=errfile)
+            continue
+        for record in records:
+            if fmt == 'csv':
+                writer.writerow(record)
+            else:
+                outfile.write(json.dumps(record))
+                outfile.write('\n')
+    return nfiles, nfailed
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", help="directories or .nra files to scan", nargs='+')
+    parser.add_argument("--format", help="output format", choices=['jsonl', 'csv'],
+                        default='jsonl')
+    parser.add_argument("--output", help="output file, standard out by default")
+    parser.add_argument("--workers", help="number of worker processes", type=int)
+    args = parser.parse_args()
+
+    filenames = (filename for top in args.paths for filename in findNeroFiles(top))
+    results = scanNeroFiles(filenames, workers=args.workers)
+
+    if args.output:
+        with open(args.output, 'w', newline='') as outfile:
+            nfiles, nfailed = writeCatalog(results, outfile, args.format)
+    else:
+        nfiles, nfailed = writeCatalog(results, sys.stdout, args.format)
+    print(nfiles, 'files scanned,', nfailed, 'failed', file=sys.stderr)
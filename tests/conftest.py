@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import audioutils
+
+@pytest.fixture(autouse=True)
+def private_caches(tmp_path_factory, monkeypatch):
+    """Keep the tests out of the user's cache directory.  The shared
+    caches are kept in memory and anything else that asks for a cache
+    path gets a scratch directory.
+
+    """
+    monkeypatch.setenv('NEROTOOLS_CACHE_DIR', str(tmp_path_factory.mktemp('cache')))
+    monkeypatch.setattr(audioutils, '_wave_header_cache', audioutils.WaveHeaderCache())
+    monkeypatch.setattr(audioutils, '_loudness_cache', audioutils.LoudnessCache())
@@ -0,0 +1,18 @@
+from byteutils import readInt, readInts, writeInt, writeInts
+
+def test_round_trip():
+    values = [0, 1, 9, 120, 65535, 65536, 0xffffffff]
+    position, decoded = readInts(writeInts(values), 0, len(values))
+    assert position == 4*len(values)
+    assert decoded == values
+
+def test_negative_values_are_masked():
+    # A zero length wavefile gives a track length of -1.
+    assert writeInts([-1, 2]) == b'\xff\xff\xff\xff\x02\x00\x00\x00'
+    assert writeInts([-1], 2) == b'\xff\xff'
+    assert writeInts([-1], 3) == b'\xff\xff\xff'
+    assert writeInt(-1) == writeInts([-1])
+
+def test_odd_sizes():
+    assert writeInt(0x123456, 3) == b'\x56\x34\x12'
+    assert readInt(b'\x56\x34\x12', 0, 3) == (3, 0x123456)
@@ -0,0 +1,98 @@
+import os
+import shutil
+
+import pytest
+
+import cachenerofile
+from benchnerofile import makeAlbum
+from cachenerofile import (encodeAlbum, decodeAlbum, readNeroFileCached, AlbumCacheError,
+                           ALBUM_STRINGS, ALBUM_LISTS, TRACK_STRINGS, TRACK_NUMBERS)
+from editnerofile import patchNeroFile
+from readnerofile import readNeroFile
+
+CHORDS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      '00Samples', 'Chords.nra')
+
+def assertSameTrack(track, expected):
+    for name in TRACK_STRINGS + TRACK_NUMBERS:
+        assert getattr(track, name) == getattr(expected, name)
+    assert list(track.frames) == list(expected.frames)
+    assert bytes(track.filter_tag)  == bytes(expected.filter_tag)
+    assert bytes(track.filter_data) == bytes(expected.filter_data)
+
+def assertSameAlbum(album, expected):
+    for name in ALBUM_STRINGS + ALBUM_LISTS + ('disc_count', 'hex_value'):
+        assert getattr(album, name) == getattr(expected, name)
+    assert len(album.tracks) == len(expected.tracks)
+    for track, other in zip(album.tracks, expected.tracks):
+        assertSameTrack(track, other)
+    assert len(album.discs) == len(expected.discs)
+    for disc, other in zip(album.discs, expected.discs):
+        assert (disc.title, disc.discno) == (other.title, other.discno)
+        assert len(disc.tracks) == len(other.tracks)
+        for track, expected_track in zip(disc.tracks, other.tracks):
+            assertSameTrack(track, expected_track)
+
+def test_round_trip_parsed():
+    album = readNeroFile(CHORDS, trace=None)
+    decoded, path, size, mtime_ns = decodeAlbum(encodeAlbum(album, '/some/path', 1234, 5678))
+    assert (path, size, mtime_ns) == ('/some/path', 1234, 5678)
+    assertSameAlbum(decoded, album)
+    # The disc still shares the album's track list.
+    assert decoded.discs[0].tracks is decoded.tracks
+
+def test_round_trip_multi_disc(tmp_path):
+    album = makeAlbum(3, str(tmp_path), num_discs=2, seconds=1)
+    album.tracks[1].filter_data = b'\x01\x02\x03'
+    decoded = decodeAlbum(encodeAlbum(album))[0]
+    assertSameAlbum(decoded, album)
+    # Tracks on a disc and in Album.tracks are the same objects.
+    assert decoded.discs[1].tracks[0] is decoded.tracks[3]
+
+def test_corrupt_data():
+    data = encodeAlbum(readNeroFile(CHORDS, trace=None), '/some/path')
+    for length in range(len(data)):
+        with pytest.raises(AlbumCacheError):
+            decodeAlbum(data[:length])
+
+    garbled = [b'XXXX' + data[4:],
+               data[:4] + b'\x63\x00\x00\x00' + data[8:],
+               data + b'\x00']
+    # The length of the path, then the path itself.
+    position = 12 + 16
+    garbled.append(data[:position] + b'\xff\xff\xff\x7f' + data[position+4:])
+    garbled.append(data[:position+4] + b'\xff' + data[position+5:])
+    for bad in garbled:
+        with pytest.raises(AlbumCacheError):
+            decodeAlbum(bad)
+
+def test_changed_file_is_parsed_again(tmp_path, monkeypatch):
+    filename = str(tmp_path / 'Chords.nra')
+    shutil.copyfile(CHORDS, filename)
+    cachedir = str(tmp_path / 'cache')
+
+    parsed = []
+    def counting(*args, **kwargs):
+        parsed.append(args[0])
+        return readNeroFile(*args, **kwargs)
+    monkeypatch.setattr(cachenerofile, 'readNeroFile', counting)
+
+    album = readNeroFileCached(filename, cachedir)
+    assertSameAlbum(readNeroFileCached(filename, cachedir), album)
+    assert len(parsed) == 1
+
+    # A new modification time.
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    readNeroFileCached(filename, cachedir)
+    assert len(parsed) == 2
+
+    # A new size with the old modification time.
+    stat = os.stat(filename)
+    patchNeroFile(filename, cd_text={'title': album.title + ' again'})
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.path.getsize(filename) != stat.st_size
+    assert readNeroFileCached(filename, cachedir).title == album.title + ' again'
+    assert len(parsed) == 3
+    readNeroFileCached(filename, cachedir)
+    assert len(parsed) == 3
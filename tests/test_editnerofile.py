@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from benchnerofile import makeAlbum
+from editnerofile import NeroEditor, patchNeroFile
+from readnerofile import readNeroFile, readNeroLayout
+from validatenerofile import validateNeroFile
+from writenerofile import writeNeroFile
+
+def project(tmp_path, num_tracks):
+    """Write a project and return (album, filename)."""
+    album = makeAlbum(num_tracks, str(tmp_path), seconds=1)
+    filename = os.path.join(str(tmp_path), 'project.nra')
+    with open(filename, 'wb') as file:
+        file.write(writeNeroFile(album))
+    return album, filename
+
+def layout(filename):
+    with open(filename, 'rb') as file:
+        return readNeroLayout(file.read(), filename)
+
+def check(album, filename):
+    """The edited file must validate, read back with the new strings and
+    be the file the writer makes for the edited album.
+
+    """
+    assert validateNeroFile(filename) is None
+    with open(filename, 'rb') as file:
+        assert file.read() == writeNeroFile(album)
+    edited = readNeroFile(filename, trace=None)
+    for name in ('title', 'artist', 'comment'):
+        assert getattr(edited, name) == getattr(album, name)
+    assert len(edited.tracks) == len(album.tracks)
+    for track, expected in zip(edited.tracks, album.tracks):
+        assert track.track_name  == expected.track_name
+        assert track.artist_name == expected.artist_name
+        assert track.isrc        == expected.isrc
+        assert track.file_name   == expected.file_name
+
+def test_same_length(tmp_path):
+    album, filename = project(tmp_path, 3)
+    size = os.path.getsize(filename)
+    album.title = album.title.upper()
+    album.tracks[1].trackName(album.tracks[1].track_name.upper())
+    patchNeroFile(filename, cd_text={'title': album.title},
+                  tracks={1: {'track_name': album.tracks[1].track_name}})
+    assert os.path.getsize(filename) == size
+    check(album, filename)
+
+def test_length_change(tmp_path):
+    album, filename = project(tmp_path, 3)
+    start, end = layout(filename).tracks[0]
+    album.comment = 'a much longer comment than the one it replaces'
+    album.tracks[0].artistName('x')
+    album.tracks[0].fileName('C:\\Somewhere\\Else\\track.wav')
+    with NeroEditor(filename) as editor:
+        editor.setCdText('comment', album.comment)
+        editor.setTrackText(0, 'artist_name', album.tracks[0].artist_name)
+        editor.setTrackText(0, 'file_name', album.tracks[0].file_name)
+        newstart, newend = editor.layout.tracks[0]
+    assert newstart - start == 2*(len(album.comment) - 20)
+    check(album, filename)
+
+def test_too_long(tmp_path):
+    album, filename = project(tmp_path, 1)
+    with open(filename, 'rb') as file:
+        before = file.read()
+    with pytest.raises(ValueError):
+        patchNeroFile(filename, cd_text={'title': 'x'*256})
+    with open(filename, 'rb') as file:
+        assert file.read() == before
+
+def test_bad_track_index(tmp_path):
+    album, filename = project(tmp_path, 3)
+    with NeroEditor(filename) as editor:
+        for index in (-1, 3):
+            with pytest.raises(IndexError):
+                editor.setTrackText(index, 'track_name', 'x')
+    check(album, filename)
+
+@pytest.mark.parametrize('num_tracks', [1, 2, 5])
+def test_track_count(tmp_path, num_tracks):
+    album, filename = project(tmp_path, num_tracks)
+    last = album.tracks[-1]
+    last.trackName('the last track of %d'%num_tracks)
+    last.ISRC('USK401409999')
+    patchNeroFile(filename, tracks={num_tracks-1: {'track_name': last.track_name,
+                                                   'isrc': last.isrc}})
+    check(album, filename)
+    assert len(layout(filename).tracks) == num_tracks
@@ -0,0 +1,62 @@
+from benchnerofile import makeAlbum
+from byteutils import readInt, writeInt
+from readnerofile import readNeroLayout
+from validatenerofile import validateNeroData, validateNeroFile
+from writenerofile import writeNeroFile
+
+def project(tmp_path, num_tracks):
+    """The data of a project and its layout."""
+    data = bytes(writeNeroFile(makeAlbum(num_tracks, str(tmp_path), seconds=1)))
+    return data, readNeroLayout(data)
+
+def setInt(data, position, value):
+    return data[:position] + writeInt(value) + data[position+4:]
+
+def test_good_file(tmp_path):
+    data, layout = project(tmp_path, 3)
+    assert validateNeroData(data) is None
+    filename = str(tmp_path / 'good.nra')
+    with open(filename, 'wb') as file:
+        file.write(data)
+    assert validateNeroFile(filename) is None
+
+def test_no_tracks(tmp_path):
+    data, layout = project(tmp_path, 0)
+    assert layout.num_tracks == 0
+    assert validateNeroData(data) is None
+
+def test_empty_file(tmp_path):
+    filename = str(tmp_path / 'empty.nra')
+    open(filename, 'wb').close()
+    assert validateNeroFile(filename) == (0, 'empty file')
+
+def test_truncated(tmp_path):
+    data, layout = project(tmp_path, 3)
+    bust = layout.bust[0]
+
+    # Cut inside the second track, the problem is its GULP data.
+    start, end = layout.tracks[1]
+    offset, message = validateNeroData(data[:end-10])
+    assert offset == start + 8
+    assert 'track 2' in message
+
+    # Cut inside the BUST header and inside the burn options.
+    assert validateNeroData(data[:bust+6])[0] == bust
+    offset, message = validateNeroData(data[:-1])
+    assert offset == bust + 8
+    assert 'burn options' in message
+
+def test_bad_gulp_length(tmp_path):
+    data, layout = project(tmp_path, 3)
+    start, end = layout.tracks[2]
+    length = readInt(data, start+4)[1]
+    offset, message = validateNeroData(setInt(data, start+4, length+4))
+    assert offset == start + 4
+    assert 'track 3 GULP length' in message
+
+def test_bad_bust_length(tmp_path):
+    data, layout = project(tmp_path, 3)
+    bust = layout.bust[0]
+    offset, message = validateNeroData(setInt(data, bust+4, 124))
+    assert offset == bust + 4
+    assert 'BUST length is 124' in message
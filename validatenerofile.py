@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+
+"""
+Check that Nero project (.nra) files are well formed.
+
+Only the length fields are followed: the header, the track options
+length, the track counts, the string and filter lengths inside each
+GULP section and the BUST section.  No string is decoded, so even
+large numbers of files check quickly.  The first inconsistency is
+reported with its offset.
+
+"""
+
+import os
+import sys
+import mmap
+import argparse
+
+from byteutils import readInt
+from readnerofile import NERO_HEADER_BYTES
+from scannerofiles import findNeroFiles
+
+# Bytes in a GULP section besides the eight strings and the filter
+# data: frame ints, track number, protection, filter tag, filter
+# length, mystery bytes and the trailing mystery bytes.
+TRACK_FIXED_BYTES = 28 + 2 + 4 + 4 + 4 + 14 + 4
+
+# Burn option ints and the trailing bytes after the BUST length.
+BUST_DATA_BYTES = 26*4 + 8
+
+class _Problem(Exception):
+    def __init__(self, offset, message):
+        Exception.__init__(self, message)
+        self.offset  = offset
+        self.message = message
+
+def validateNeroData(nradata):
+    """Check the structure of .nra data.  Returns None if it is good,
+    otherwise (offset, message) for the first problem found.
+
+    """
+    try:
+        _checkNeroData(nradata)
+    except _Problem as problem:
+        return problem.offset, problem.message
+    return None
+
+def validateNeroFile(filename):
+    """Check a .nra file, see validateNeroData.
+
+    """
+    with open(filename, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return 0, 'empty file'
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as nramap:
+            return validateNeroData(nramap)
+
+def _checkNeroData(nradata):
+
+    size = len(nradata)
+
+    def need(position, nbytes, what):
+        if position+nbytes > size:
+            raise _Problem(position, '%s runs past the end of the file (%d bytes)'%(what, size))
+
+    def readLength(position, what):
+        need(position, 4, what)
+        return readInt(nradata, position)
+
+    position = len(NERO_HEADER_BYTES)
+    need(0, position, 'header')
+    if (nradata[0:position] != NERO_HEADER_BYTES):
+        raise _Problem(0, 'not a Nero audio CD project header')
+    position,track_option_length = readLength(position, 'track options length')
+
+    for cnt in range(7):
+        need(position, 4, 'CD text string')
+        if (nradata[position+2] != 0xff):
+            raise _Problem(position, 'CD text string %d has no length marker'%(cnt+1))
+        nextpos = position + 4 + 2*nradata[position+3]
+        need(position, nextpos-position, 'CD text string')
+        position = nextpos
+
+    # The zero byte and 4 CD option ints come before the part covered
+    # by the track options length.
+    options_start = position + 17
+    need(position, 17, 'CD options')
+    if (nradata[position] != 0):
+        raise _Problem(position, 'CD options do not start with a zero byte')
+
+    # 3 ints, the track count, one int per track, the 12 byte hex value
+    # and then the global track options.
+    position,num_tracks = readLength(options_start+12, 'track count')
+    fixed = 12 + 4 + 4*num_tracks + 12
+    if (track_option_length < fixed) or ((track_option_length-fixed)%4 != 0):
+        raise _Problem(len(NERO_HEADER_BYTES),
+                       'track options length %d does not fit %d tracks'
+                       %(track_option_length, num_tracks))
+    options_end = options_start + track_option_length
+    need(options_end, 6, 'track options')
+    if (nradata[options_end:options_end+2] != b'\x00\x00'):
+        raise _Problem(options_end, 'track options are not followed by two zero bytes')
+    position,num_tracks_again = readInt(nradata, options_end+2)
+    if (num_tracks_again != num_tracks):
+        raise _Problem(options_end+2, 'track count %d does not match %d in the options'
+                       %(num_tracks_again, num_tracks))
+
+    for track_number in range(num_tracks):
+        need(position, 8, 'GULP header')
+        if (nradata[position:position+4] != b'GULP'):
+            raise _Problem(position, 'expected GULP tag for track %d'%(track_number+1))
+        start,cnt = readInt(nradata, position+4)
+        section_end = start + cnt
+        need(start, cnt, 'track %d'%(track_number+1))
+
+        # Walk the strings and the filter section inside the track.
+        nbytes = TRACK_FIXED_BYTES
+        stringpos = start
+        for string in range(8):
+            if string == 7:
+                filterpos = stringpos + 28 + 2 + 4 + 4
+                if (filterpos+4 > section_end):
+                    raise _Problem(filterpos, 'track %d filter length is past the end '
+                                   'of its section'%(track_number+1))
+                filterpos,filterlen = readInt(nradata, filterpos)
+                nbytes += filterlen
+                stringpos = filterpos + filterlen + 14
+            if (stringpos+4 > section_end):
+                raise _Problem(stringpos, 'track %d string %d is past the end of its section'
+                               %(track_number+1, string+1))
+            stringpos,strlen = readInt(nradata, stringpos)
+            stringpos += 2*(strlen+1)
+            nbytes += 4 + 2*(strlen+1)
+        if (nbytes != cnt):
+            raise _Problem(position+4, 'track %d GULP length is %d but its fields add up to %d'
+                           %(track_number+1, cnt, nbytes))
+        position = section_end
+
+    need(position, 8, 'BUST header')
+    if (nradata[position:position+4] != b'BUST'):
+        raise _Problem(position, 'expected BUST tag')
+    nextpos,bust_length = readInt(nradata, position+4)
+    if (size-nextpos != BUST_DATA_BYTES):
+        raise _Problem(nextpos, 'burn options are %d bytes, expected %d'
+                       %(size-nextpos, BUST_DATA_BYTES))
+    if (bust_length != size-position):
+        raise _Problem(position+4, 'BUST length is %d but the section is %d bytes'
+                       %(bust_length, size-position))
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", help="directories or .nra files to check", nargs='+')
+    parser.add_argument("--quiet", help="only report bad files", action="store_true")
+    args = parser.parse_args()
+
+    nfiles = 0
+    nbad = 0
+    for top in args.paths:
+        for filename in findNeroFiles(top):
+            nfiles += 1
+            try:
+                problem = validateNeroFile(filename)
+            except OSError as err:
+                problem = (0, str(err))
+            if problem is not None:
+                nbad += 1
+                print('%s: offset %d (0x%x): %s'%(filename, problem[0], problem[0], problem[1]))
+            elif not args.quiet:
+                print('%s: ok'%filename)
+    print(nfiles, 'files checked,', nbad, 'bad', file=sys.stderr)
+    sys.exit(1 if nbad else 0)
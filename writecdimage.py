@@ -0,0 +1,213 @@
+#!/usr/bin/python3
+
+"""
+Write a raw CD-DA disc image (.bin) and a matching cdrdao TOC file
+for one disc of an Album.
+
+The tracks are laid out with the same frames as the .nra file:
+each track after the first is preceded by its pregap of silence
+(Track.frames[FRAME_SILENCE]) and its audio is padded with silence to
+a whole number of frames.  The pregap of the first track is the two
+seconds every disc starts with, cdrdao adds it by itself so it is not
+in the image.
+
+The audio is moved from the wavefiles to the image with
+copy_file_range or sendfile where the system has them, otherwise a
+block at a time.  No track is ever held in memory.  The samples are
+left little endian, as they are in the wavefiles, unless swap is
+asked for.  Without it burn the image with cdrdao write --swap.
+
+"""
+
+import os
+import sys
+import argparse
+from array import array
+
+from audioutils import probeWavefileHeaders, FRAMES_PER_SECOND
+from cdutils import FRAME_TRACK_LENGTH, FRAME_SILENCE
+from readnerofile import readNeroFile
+from writenerofile import discFrames
+
+# Bytes in one CD-DA frame: 588 stereo 16 bit samples.
+CDDA_FRAME_BYTES = 2352
+
+# Bytes moved per system call when copying.
+COPY_BLOCK = 1 << 20
+
+_zeros = bytes(COPY_BLOCK)
+
+def _writeAll(outfd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(outfd, view):]
+
+def _writeZeros(outfd, count):
+    while count > 0:
+        nbytes = min(count, COPY_BLOCK)
+        _writeAll(outfd, _zeros[:nbytes])
+        count -= nbytes
+
+def _copyRange(infd, outfd, offset, count, swap=False):
+    """Copy count bytes from offset in infd to the current position of
+    outfd.  Returns the number of bytes copied, less than count if the
+    input runs out.
+
+    """
+    methods = []
+    if not swap:
+        if hasattr(os, 'copy_file_range'):
+            methods.append(lambda nbytes: os.copy_file_range(infd, outfd, nbytes, offset))
+        if hasattr(os, 'sendfile'):
+            methods.append(lambda nbytes: os.sendfile(outfd, infd, offset, nbytes))
+
+    def buffered(nbytes):
+        data = os.pread(infd, nbytes, offset)
+        if swap:
+            samples = array('h')
+            samples.frombytes(data[:len(data)&~1])
+            if sys.byteorder == 'little':
+                samples.byteswap()
+            data = samples.tobytes()
+        _writeAll(outfd, data)
+        return len(data)
+    methods.append(buffered)
+
+    copied = 0
+    while copied < count:
+        nbytes = min(count-copied, COPY_BLOCK)
+        try:
+            moved = methods[0](nbytes)
+        except OSError:
+            # Not supported between these files, try the next way.
+            if len(methods) == 1:
+                raise
+            methods.pop(0)
+            continue
+        if moved == 0:
+            break
+        copied += moved
+        offset += moved
+    return copied
+
+def imageLayout(frames):
+    """The (pregap, length) in frames of each track in the image, from
+    the frame ints of the tracks.
+
+    """
+    layout = []
+    for trackno, trklength in enumerate(frames):
+        pregap = trklength[FRAME_SILENCE] if trackno > 0 else 0
+        layout.append((pregap, trklength[FRAME_TRACK_LENGTH]+1))
+    return layout
+
+def writeCdImage(album, binfile, tocfile=None, discno=1, frames=None, wavehdrs=None,
+                 swap=False):
+    """Write the image of one disc of an album to binfile and, if
+    tocfile is given, a cdrdao TOC file for it.  Returns the number of
+    bytes in the image.
+
+    frames is a list with the frame ints of each track, by default they
+    are worked out by writenerofile.discFrames.  wavehdrs is an
+    optional list of wavefile headers in track order.
+
+    """
+    tracks = album.discs[discno-1].tracks
+    if wavehdrs is None:
+        wavehdrs = probeWavefileHeaders([track.linux_file_name for track in tracks])
+    for track, wavehdr in zip(tracks, wavehdrs):
+        if ((wavehdr["rate"] != 44100) or (wavehdr["channels"] != 2) or
+            (wavehdr["bitsperchannel"] != 16)):
+            raise ValueError('%s: CD audio must be 44.1 kHz 16 bit stereo'
+                             %track.linux_file_name)
+    if frames is None:
+        frames = discFrames(album, discno, wavehdrs)
+    layout = imageLayout(frames)
+
+    nbytes = 0
+    with open(binfile, 'wb', buffering=0) as outfile:
+        outfd = outfile.fileno()
+        for track, wavehdr, (pregap, length) in zip(tracks, wavehdrs, layout):
+            _writeZeros(outfd, pregap*CDDA_FRAME_BYTES)
+            count = min(wavehdr["nbytes"], length*CDDA_FRAME_BYTES)
+            with open(track.linux_file_name, 'rb') as infile:
+                copied = _copyRange(infile.fileno(), outfd, wavehdr["dataoffset"], count, swap)
+            _writeZeros(outfd, length*CDDA_FRAME_BYTES - copied)
+            nbytes += (pregap+length)*CDDA_FRAME_BYTES
+
+    if tocfile is not None:
+        with open(tocfile, 'w') as file:
+            file.write(cdImageToc(album, os.path.basename(binfile), discno, layout, swap))
+    return nbytes
+
+def _msf(frames):
+    seconds, frame = divmod(frames, FRAMES_PER_SECOND)
+    minutes, second = divmod(seconds, 60)
+    return '%02d:%02d:%02d'%(minutes, second, frame)
+
+def _tocString(text):
+    return '"%s"'%text.replace('\\', '\\\\').replace('"', '\\"')
+
+def _tocCdText(lines, title, performer, language_map=False):
+    lines.append('CD_TEXT {')
+    if language_map:
+        lines.append('  LANGUAGE_MAP {')
+        lines.append('    0 : EN')
+        lines.append('  }')
+    lines.append('  LANGUAGE 0 {')
+    lines.append('    TITLE ' + _tocString(title))
+    lines.append('    PERFORMER ' + _tocString(performer))
+    lines.append('  }')
+    lines.append('}')
+
+def cdImageToc(album, binname, discno, layout, swap=False):
+    """The text of a cdrdao TOC file for an image written by
+    writeCdImage.  layout is as returned by imageLayout.
+
+    """
+    tracks = album.discs[discno-1].tracks
+    lines = ['CD_DA', '']
+    if not swap:
+        lines.append('// The samples are little endian, use cdrdao write --swap.')
+        lines.append('')
+    mcn = album.mcn.strip()
+    if (len(mcn) == 13) and mcn.isdigit():
+        lines.append('CATALOG "%s"'%mcn)
+        lines.append('')
+    _tocCdText(lines, album.title, album.artist, language_map=True)
+
+    position = 0
+    for trackno, (track, (pregap, length)) in enumerate(zip(tracks, layout)):
+        lines.append('')
+        lines.append('// Track %d'%(trackno+1))
+        lines.append('TRACK AUDIO')
+        if len(track.isrc) == 12:
+            lines.append('ISRC "%s"'%track.isrc)
+        _tocCdText(lines, track.track_name, track.artist_name)
+        lines.append('FILE %s %s %s'%(_tocString(binname), _msf(position), _msf(pregap+length)))
+        if pregap > 0:
+            lines.append('START %s'%_msf(pregap))
+        position += pregap + length
+    lines.append('')
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filename", help="Nero nra file name")
+    parser.add_argument("binfile", help="image file name", nargs="?", default="Output.bin")
+    parser.add_argument("--toc", help="TOC file name, the image name with .toc by default")
+    parser.add_argument("--root", help="directory the track file names are relative to, "
+                        "the directory of the nra file by default")
+    parser.add_argument("--swap", help="write big endian samples", action="store_true")
+    args = parser.parse_args()
+
+    album = readNeroFile(args.filename, trace=None)
+    root = args.root or os.path.dirname(os.path.abspath(args.filename))
+    for track in album.tracks:
+        track.linuxFileName(os.path.join(root, track.file_name.replace('\\', '/')))
+
+    tocfile = args.toc or os.path.splitext(args.binfile)[0] + '.toc'
+    nbytes = writeCdImage(album, args.binfile, tocfile,
+                          frames=[track.frames for track in album.tracks], swap=args.swap)
+    print(args.binfile, nbytes, 'bytes,', nbytes//CDDA_FRAME_BYTES, 'frames', file=sys.stderr)
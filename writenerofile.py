@@ -11,204 +11,387 @@ Written by Robert T. Short.
 
 import argparse
 from math import ceil
+from concurrent.futures import ProcessPoolExecutor
 
-from byteutils import writeInt, writeShortString, writeLongString
-from audioutils import readWavefileHeader
+from byteutils import writeInt, writeInts, writeShortString, writeLongString
+from audioutils import readWavefileHeaderCached, probeWavefileHeaders, findSilences
+from audioutils import measureTrackLoudness, normalizeWanted, FRAMES_PER_SECOND
 from cdutils import Album, Disc, Track
+from nerostats import NeroStats
+
+def writeNeroFile(album, discno=1, outfile=None, probe_workers=0, stats=None,
+                  wavehdrs=None, cdtext=None, template=None, analyze_silence=False):
+    """Build the .nra data for one disc of an album.
+
+    Without outfile the data is returned as a bytearray.  With a binary
+    file-like outfile each section is written to it as soon as it is
+    built and the number of bytes written is returned.  Either way the
+    work done is linear in the number of tracks.
+
+    If probe_workers is more than zero the wavefile headers for the
+    whole disc are read up front by that many threads instead of one
+    at a time as each track is built.
+
+    stats is an optional nerostats.NeroStats that collects the time
+    spent on each section.
+
+    wavehdrs, cdtext and template are passed on to neroSections.
+
+    With analyze_silence=True the audio of every track is scanned for
+    silence at its start and end (this needs NumPy) and the pregaps are
+    shortened to allow for it, see neroSections.
+
+    """
+
+    silences = None
+    if analyze_silence:
+        if stats:
+            clock = stats.start()
+        tracks = album.discs[discno-1].tracks
+        silences = findSilences([track.linux_file_name for track in tracks],
+                                max_workers=max(probe_workers, 1))
+        if stats:
+            stats.lap('silence', clock)
+
+    if (wavehdrs is None) and (probe_workers > 0):
+        if stats:
+            clock = stats.start()
+        tracks = album.discs[discno-1].tracks
+        wavehdrs = probeWavefileHeaders([track.linux_file_name for track in tracks],
+                                        max_workers=probe_workers)
+        if stats:
+            stats.lap('wave probe', clock)
+
+    if outfile is None:
+        outbytes = bytearray()
+        for section in neroSections(album, discno, wavehdrs, stats, cdtext, template, silences):
+            outbytes += section
+        return outbytes
+
+    nbytes = 0
+    for section in neroSections(album, discno, wavehdrs, stats, cdtext, template, silences):
+        if stats:
+            clock = stats.start()
+        outfile.write(section)
+        if stats:
+            stats.lap('file io', clock, len(section))
+        nbytes += len(section)
+    return nbytes
+
+def encodeCdText(album):
+    """Encode the seven CD text strings of an album.
+
+    """
+    return b''.join([writeShortString(album.title),
+                     writeShortString(album.artist),
+                     writeShortString(album.copyright),
+                     writeShortString(album.author),
+                     writeShortString(album.mcn),
+                     writeShortString(album.rdate),
+                     writeShortString(album.comment)])
+
+class NeroTemplate:
+    """The parts of a .nra file that are the same for every project,
+    encoded once.  Building a project from a template only encodes the
+    CD text, the track counts and the track sections and splices them
+    in between the precomputed blocks.
+
+    The arguments override the option values normally used.  There
+    must be 7 CD options and a 12 byte hex value.  The burn options are
+    either the 26 ints of Album.burn_options or 27 with the BUST length
+    first.
+
+    """
+    def __init__(self, cd_options=None, hex_value=None, global_track_options=None,
+                 burn_options=None, track_protection=0x40, silence_time=2):
+
+        # Fixed CD and track options.
+        header     = 'NeroCDAV8.0.0'
+
+        if cd_options is None:
+            cd_options = [0,0,1,1,9,0,0]
+
+        if hex_value is None:
+            hex_value = b'\x0a\x00\x00\x80\x0b\xee\x20\x5e\x00\x00\x00\x00'
+
+        if global_track_options is None:
+            global_track_options = [0,0,1]
+
+        gulptag = b'GULP'
+        busttag = b'BUST'
+
+        filter_bytes     = b'ENON\x08\x00\x00\x00' + b'\x00'*8
+        mystery_bytes1   = b'\x00'*14
+        mystery_bytes2   = b'\x00'*4
+        mystery_str1   = ""
+        mystery_str2   = ""
+
+        if burn_options is None:
+            burn_options = [120,0,1,1,1,0,0,1,1,0,0,65536,65535,0,0,1,0,1,0,0,0,0,0,0,1,0,0]
+        burn_tail        = b'\xff'*4 + b'\00'*4
+
+        # The readers expect 7 CD option ints, a 12 byte hex value and the
+        # BUST length followed by 26 burn option ints.
+        if len(cd_options) != 7:
+            raise ValueError('CD options must be 7 ints, not %d'%len(cd_options))
+        if len(hex_value) != 12:
+            raise ValueError('hex value must be 12 bytes, not %d'%len(hex_value))
+        if len(burn_options) == 26:
+            burn_options = [len(busttag) + 4*27 + len(burn_tail)] + list(burn_options)
+        if len(burn_options) != 27:
+            raise ValueError('burn options must be 26 or 27 ints, not %d'%len(burn_options))
+        if burn_options[0] != len(busttag) + 4*len(burn_options) + len(burn_tail):
+            raise ValueError('BUST length %d does not match %d burn options'
+                             %(burn_options[0], len(burn_options)))
+
+        self.cd_options           = list(cd_options)
+        self.hex_value            = bytes(hex_value)
+        self.global_track_options = list(global_track_options)
+        self.burn_options         = list(burn_options)
+        self.track_protection     = track_protection
+        self.silence_time         = silence_time
+
+        # The precomputed blocks.
+        self.header_bytes        = writeShortString(header)
+        self.cd_options_bytes    = b'\x00' + writeInts(cd_options)
+        self.track_flag_bytes    = writeInt(1)
+        self.track_options_bytes = hex_value + writeInts(global_track_options) + b'\x00\x00'
+        self.gulp_bytes          = gulptag + b'\x00'*4
+        self.mystery_str1_bytes  = writeLongString(mystery_str1)
+        self.mystery_str2_bytes  = writeLongString(mystery_str2)
+        self.track_tail_bytes    = writeInt(track_protection) + filter_bytes + mystery_bytes1
+        self.mystery_bytes2      = mystery_bytes2
+        self.bust_bytes          = busttag + writeInts(burn_options) + burn_tail
+
+        # The track options count runs from the fifth CD option int (the
+        # one holding 9) to the two zero bytes, leaving out the per
+        # track flags and the track count which depend on the disc.
+        self.track_option_length = (len(self.cd_options_bytes) - 17 + 4 +
+                                    len(self.track_options_bytes) - 2)
+
+    def headerBlock(self, num_tracks, cdtext):
+        """The header, the track options count and the CD text."""
+
+        # The track options count field.
+        cnt = self.track_option_length + 4*num_tracks
+        return self.header_bytes + writeInt(cnt) + cdtext
+
+    def optionsBlock(self, num_tracks):
+        """The global CD and track options and the number of tracks."""
+        trkbytes = writeInt(num_tracks)
+        return b''.join([self.cd_options_bytes, trkbytes, self.track_flag_bytes*num_tracks,
+                         self.track_options_bytes, trkbytes])
+
+    def trackStrings(self, track):
+        """The seven strings at the start of a track section."""
+        full_file_name = track.file_name
+        file_name      = full_file_name[full_file_name.rfind('\\')+1:]
+        return b''.join([writeLongString(full_file_name),
+                         self.mystery_str1_bytes,
+                         writeLongString(file_name),
+                         writeLongString(track.artist_name),
+                         writeLongString(track.track_name),
+                         self.mystery_str2_bytes,
+                         writeLongString(track.isrc)])
+
+    def trackSection(self, trackno, track, strings, trklength):
+        """A complete GULP section.  trackno counts from zero, strings is
+        from trackStrings and trklength holds the seven frame ints.
+
+        """
+
+        # The GULP length is not known until the section is built, so
+        # leave room for it and fill it in at the end.
+        track_bytes = bytearray(self.gulp_bytes)
+        start = len(track_bytes)
+        track_bytes += strings
+        track_bytes += writeInts(trklength)
+        track_bytes += writeInt(trackno+1,2)
+        track_bytes += self.track_tail_bytes
+        track_bytes += writeLongString(track.file_name)
+        track_bytes += self.mystery_bytes2
+        track_bytes[start-4:start] = writeInt(len(track_bytes)-start)
+        return track_bytes
+
+    def bustBlock(self):
+        """The burn options."""
+        return self.bust_bytes
+
+# The template used when none is given.
+DEFAULT_TEMPLATE = NeroTemplate()
+
+def neroSections(album, discno=1, wavehdrs=None, stats=None, cdtext=None, template=None,
+                 silences=None):
+    """Generate the .nra data for one disc of an album as a sequence of
+    byte blocks: the header and CD text, the global options, one block
+    per track (GULP) and the burn options (BUST).
+
+    wavehdrs is an optional list of wavefile headers in track order, as
+    returned by probeWavefileHeaders.  Without it each track's file is
+    read as the track is reached.  Headers come from the shared
+    wavefile header cache in audioutils.
+
+    If stats is given the time spent building each section is added to
+    it.  Time spent by the caller between blocks is not counted.
+
+    cdtext is the CD text as encoded by encodeCdText.  It is the same for
+    every disc of an album so it can be encoded once and shared.
+
+    template is a NeroTemplate holding the fixed parts of the file,
+    DEFAULT_TEMPLATE if not given.
+
+    silences is an optional list, in track order, of the dictionaries
+    returned by audioutils.findSilence.  With it the silence added in
+    front of each track after the first is cut by the silence already
+    at the end of the track before and the start of the track itself,
+    so the gap heard between tracks is the template's silence_time.
+    The first track always gets the full pregap.
+
+    """
+
+    if template is None:
+        template = DEFAULT_TEMPLATE
+
+    tracks = album.discs[discno-1].tracks
+    num_tracks = len(tracks)
 
-def writeNeroFile(album, discno=1):
-
-    # Initialize a buffer that we will fill with the nra data.
-
-    position = 0
-    outbytes = bytearray()
-
-    # Fixed CD and track options.
-    header     = 'NeroCDAV8.0.0'
-
-    cd_options = [0,0,1,1,9,0,0]
-
-    hex_value = b'\x0a\x00\x00\x80\x0b\xee\x20\x5e\x00\x00\x00\x00'
-
-    global_track_options = [0,0,1]
-
-    gulptag = b'GULP'
-    busttag = b'BUST'
-
-    track_protection = 0x40
-    filter_bytes     = b'ENON\x08\x00\x00\x00' + b'\x00'*8
-    mystery_bytes1   = b'\x00'*14
-    mystery_bytes2   = b'\x00'*4
-    mystery_str1   = ""
-    mystery_str2   = ""
-    
-    burn_options     = [120,0,1,1,1,0,0,1,1,0,0,65536,65535,0,0,1,0,1,0,0,0,0,0,0,1,0,0]
-    burn_tail        = b'\xff'*4 + b'\00'*4
+    # CD Text.
 
-    num_tracks = len(album.discs[discno-1].tracks)
+    if stats:
+        clock = stats.start()
+    if cdtext is None:
+        cdtext = encodeCdText(album)
+    if stats:
+        clock = stats.lap('cd text', clock, len(cdtext))
 
     # Do the header.
 
-    headerbytes = writeShortString(header)
-    nextpos = position + len(headerbytes)
-    outbytes = outbytes + headerbytes
-    position = nextpos
-
-    # The track options count field.
-    cnt = 40 + 4*num_tracks
-    cntbytes = writeInt(cnt)
-    nextpos = position + len(cntbytes)
-    outbytes = outbytes + cntbytes
-    position = nextpos
-
-    # CD Text.
-
-    cdtextbytes = writeShortString(album.title)
-    nextpos = position + len(cdtextbytes)
-    outbytes = outbytes + cdtextbytes
-    position = nextpos
-
-    cdtextbytes = writeShortString(album.artist)
-    nextpos = position + len(cdtextbytes)
-    outbytes = outbytes + cdtextbytes
-    position = nextpos
-
-    cdtextbytes = writeShortString(album.copyright)
-    nextpos = position + len(cdtextbytes)
-    outbytes = outbytes + cdtextbytes
-    position = nextpos
-
-    cdtextbytes = writeShortString(album.author)
-    nextpos = position + len(cdtextbytes)
-    outbytes = outbytes + cdtextbytes
-    position = nextpos
-
-    cdtextbytes = writeShortString(album.mcn)
-    nextpos = position + len(cdtextbytes)
-    outbytes = outbytes + cdtextbytes
-    position = nextpos
-
-    cdtextbytes = writeShortString(album.rdate)
-    nextpos = position + len(cdtextbytes)
-    outbytes = outbytes + cdtextbytes
-    position = nextpos
-
-    cdtextbytes = writeShortString(album.comment)
-    nextpos = position + len(cdtextbytes)
-    outbytes = outbytes + cdtextbytes
-    position = nextpos
+    outbytes = template.headerBlock(num_tracks, cdtext)
+    if stats:
+        stats.lap('header', clock, len(outbytes)-len(cdtext))
+    yield outbytes
 
     # The global CD and track options.
-    outbytes = outbytes + b'\x00'
-    position = position + 1
-
-    for option in cd_options:
-        optbytes = writeInt(option)
-        nextpos = position + 4
-        outbytes = outbytes + optbytes
-        position = nextpos
-
-    trkbytes = writeInt(num_tracks)
-    nextpos = position + 4
-    outbytes = outbytes + trkbytes
-    position = nextpos
-
-    for cnt in range(num_tracks):
-        optbytes = writeInt(1)
-        nextpos = position + 4
-        outbytes = outbytes + optbytes
-        position = nextpos
-
-    nextpos = position + len(hex_value)
-    outbytes = outbytes + hex_value
-    position = nextpos
-
-    for option in global_track_options:
-        optbytes = writeInt(option)
-        nextpos = position + 4
-        outbytes = outbytes + optbytes
-        position = nextpos
-
-    outbytes = outbytes + b'\x00'
-    position = position + 1
-    outbytes = outbytes + b'\x00'
-    position = position + 1
+    if stats:
+        clock = stats.start()
+    outbytes = template.optionsBlock(num_tracks)
+    if stats:
+        stats.lap('cd options', clock, len(outbytes))
+    yield outbytes
 
     # Track info.
 
-    trkbytes = writeInt(num_tracks)
-    nextpos = position + 4
-    outbytes = outbytes + trkbytes
-    position = nextpos
-
-    frames_per_second = 75
-    silence_time = 2
     last_frame = 0
-    for trackno,track in enumerate(album.discs[discno-1].tracks):
-
-        full_file_name = track.file_name
-        file_name      = full_file_name[full_file_name.rfind('\\')+1:]
-        track_artist   = track.artist_name
-        track_title    = track.track_name
-        track_isrc     = track.isrc
-
-        real_file_name = track.linux_file_name
-
-        track_bytes = writeLongString(full_file_name)
-        track_bytes = track_bytes + writeLongString(mystery_str1)
-        track_bytes = track_bytes + writeLongString(file_name)
-        track_bytes = track_bytes + writeLongString(track_artist)
-        track_bytes = track_bytes + writeLongString(track_title)
-        track_bytes = track_bytes + writeLongString(mystery_str2)
-        track_bytes = track_bytes + writeLongString(track_isrc)
-
-        trklength = [0,0,0,0,0,0,0]
-        wavehdr = readWavefileHeader(real_file_name)
-        trklength[2] = ceil(frames_per_second*wavehdr["nbytes"]/wavehdr["byterate"])-1
-        trklength[4] = ceil(frames_per_second*silence_time)
-        trklength[6] = last_frame + trklength[4]
-        trklength[5] = trklength[6] + trklength[2]
+    for trackno,track in enumerate(tracks):
+
+        if stats:
+            clock = stats.start()
+        strings = template.trackStrings(track)
+        if stats:
+            clock = stats.lap('track strings', clock, len(strings))
+
+        if wavehdrs is None:
+            wavehdr = readWavefileHeaderCached(track.linux_file_name)
+            if stats:
+                clock = stats.lap('wave probe', clock)
+        else:
+            wavehdr = wavehdrs[trackno]
+        trklength = trackFrames(wavehdr, last_frame, _pregap(template, trackno, silences))
         last_frame = trklength[5]
-        for tl in trklength:
-            track_bytes = track_bytes + writeInt(tl)
-
-        track_bytes = track_bytes + writeInt(trackno+1,2)
-        track_bytes = track_bytes + writeInt(track_protection)
-        track_bytes = track_bytes + filter_bytes
-        track_bytes = track_bytes + mystery_bytes1
-        track_bytes = track_bytes + writeLongString(full_file_name)
-        track_bytes = track_bytes + mystery_bytes2
-
-        nextpos = position + len(gulptag)
-        outbytes = outbytes + gulptag
-        position = nextpos
-
-        lenbytes = writeInt(len(track_bytes))
-        nextpos = nextpos + 4
-        outbytes = outbytes + lenbytes
-        position = nextpos
-    
-        nextpos = position + len(track_bytes)
-        outbytes = outbytes + track_bytes
-        position = nextpos
-
-    # Burn info
-    nextpos = position + 4
-    outbytes = outbytes + busttag
-    position = nextpos
 
-    for option in burn_options:
-        optbytes = writeInt(option)
-        nextpos = position + 4
-        outbytes = outbytes + optbytes
-        position = nextpos
+        track_bytes = template.trackSection(trackno, track, strings, trklength)
+        if stats:
+            stats.lap('GULP', clock, len(track_bytes))
+        yield track_bytes
 
-    nextpos = position + len(burn_tail)
-    outbytes = outbytes + burn_tail
-    position = nextpos
-
-
-    return outbytes
+    # Burn info
+    if stats:
+        clock = stats.start()
+    outbytes = template.bustBlock()
+    if stats:
+        stats.lap('BUST', clock, len(outbytes))
+    yield outbytes
+
+def trackFrames(wavehdr, last_frame, pregap):
+    """The seven frame ints of a track section (see Track.frames) for a
+    track whose wavefile header is wavehdr, following a track that
+    ended at last_frame, with pregap frames of silence in front of it.
+
+    """
+    trklength = [0,0,0,0,0,0,0]
+    trklength[2] = ceil(FRAMES_PER_SECOND*wavehdr["nbytes"]/wavehdr["byterate"])-1
+    trklength[4] = pregap
+    trklength[6] = last_frame + trklength[4]
+    trklength[5] = trklength[6] + trklength[2]
+    return trklength
+
+def _pregap(template, trackno, silences):
+    pregap = ceil(FRAMES_PER_SECOND*template.silence_time)
+    if (silences is not None) and (trackno > 0):
+        pregap = max(0, pregap - silences[trackno]["leading"] - silences[trackno-1]["trailing"])
+    return pregap
+
+def discFrames(album, discno=1, wavehdrs=None, template=None, silences=None):
+    """The frame ints of every track of a disc, laid out the same way
+    neroSections does it.  The arguments are as for neroSections.
+
+    """
+    if template is None:
+        template = DEFAULT_TEMPLATE
+    tracks = album.discs[discno-1].tracks
+    if wavehdrs is None:
+        wavehdrs = [readWavefileHeaderCached(track.linux_file_name) for track in tracks]
+    frames = []
+    last_frame = 0
+    for trackno in range(len(tracks)):
+        trklength = trackFrames(wavehdrs[trackno], last_frame, _pregap(template, trackno, silences))
+        last_frame = trklength[5]
+        frames.append(trklength)
+    return frames
+
+def writeNeroDiscs(album, filenames=None, workers=0, probe_workers=8, template=None):
+    """Build the .nra data for every disc of an album in one call.
+
+    The CD text is encoded once for all the discs and the wavefile
+    headers of every track are probed together, so a file shared by
+    several discs is only read once.  With workers more than zero the
+    discs are built in that many processes.
+
+    filenames is either a list with one file name per disc or a string
+    containing %d, which is replaced by the disc number.  The data is
+    written to the files and the byte counts are returned.  Without
+    filenames a list with the data for each disc is returned.
+
+    template is the NeroTemplate to build the discs from.
+
+    """
+
+    num_discs = len(album.discs)
+    if isinstance(filenames, str):
+        filenames = [filenames%(discno+1) for discno in range(num_discs)]
+
+    cdtext = encodeCdText(album)
+    linux_file_names = [track.linux_file_name for disc in album.discs for track in disc.tracks]
+    allhdrs = probeWavefileHeaders(linux_file_names, max_workers=probe_workers)
+    wavehdrs = []
+    for disc in album.discs:
+        wavehdrs.append(allhdrs[:len(disc.tracks)])
+        allhdrs = allhdrs[len(disc.tracks):]
+
+    jobs = [(album, discno+1, wavehdrs[discno], cdtext, template,
+             filenames[discno] if filenames else None) for discno in range(num_discs)]
+    if (workers > 0) and (num_discs > 1):
+        with ProcessPoolExecutor(max_workers=min(workers, num_discs)) as pool:
+            return list(pool.map(_writeDisc, *zip(*jobs)))
+    return [_writeDisc(*job) for job in jobs]
+
+def _writeDisc(album, discno, wavehdrs, cdtext, template, filename):
+    if filename is None:
+        return writeNeroFile(album, discno, wavehdrs=wavehdrs, cdtext=cdtext,
+                             template=template)
+    with open(filename, 'wb') as file:
+        return writeNeroFile(album, discno, file, wavehdrs=wavehdrs, cdtext=cdtext,
+                             template=template)
 
 if __name__ == '__main__':
 
@@ -217,6 +400,13 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("filename", help="Nero nra file name", \
                         nargs="?", default="Output.nra")
+    parser.add_argument("--probe-workers", help="threads used to read wavefile headers", \
+                        type=int, default=0)
+    parser.add_argument("--stats", help="print time spent per section", action="store_true")
+    parser.add_argument("--analyze-silence", help="allow for silence in the audio "
+                        "when setting pregaps (needs NumPy)", action="store_true")
+    parser.add_argument("--analyze-loudness", help="measure the tracks and set the normalize "
+                        "flag if their loudness differs (needs NumPy)", action="store_true")
     args = parser.parse_args()
     filename = args.filename
     print('File:',filename)
@@ -257,11 +447,27 @@ if __name__ == '__main__':
         track.ISRC(track_isrc[trackno])
         album.discs[0].tracks.append(track)
 
-    outbytes = writeNeroFile(album, discno=1)
-
     # Write the output to files.
 
+    stats = NeroStats() if args.stats else None
+    template = None
+    if args.analyze_loudness:
+        if stats:
+            clock = stats.start()
+        tracks = album.discs[0].tracks
+        measureTrackLoudness(tracks)
+        if stats:
+            stats.lap('loudness', clock)
+        for track in tracks:
+            print(track.track_name, track.loudness)
+        if normalizeWanted(tracks):
+            options = DEFAULT_TEMPLATE.global_track_options
+            template = NeroTemplate(global_track_options=[1] + options[1:])
+            print('Normalize all tracks')
     with open(filename, 'wb') as file:
-        file.write(outbytes)
+        writeNeroFile(album, discno=1, outfile=file, probe_workers=args.probe_workers,
+                      stats=stats, template=template, analyze_silence=args.analyze_silence)
+    if stats:
+        stats.report()
 
     